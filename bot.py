@@ -2,6 +2,11 @@ import discord
 from discord import app_commands
 import aiohttp
 import config
+from services.history import history
+from services.youtube import resolver
+from utils.accounts import accounts
+from utils.cache import cache
+from utils import image, upstream
 
 # switch to commands.bot for better extension support
 from discord.ext import commands
@@ -14,7 +19,8 @@ class MusicBot(commands.Bot):
         self.session: aiohttp.ClientSession = None
 
     async def setup_hook(self):
-        self.session = aiohttp.ClientSession()
+        # shared pooled client, see utils.upstream for connector and timeout tuning
+        self.session = upstream.create_session()
         
         # load extensions
         await self.load_extension("commands.nowplaying")
@@ -22,6 +28,8 @@ class MusicBot(commands.Bot):
         await self.load_extension("commands.charts")
         await self.load_extension("commands.ai")
         await self.load_extension("commands.currency")
+        await self.load_extension("commands.history")
+        await self.load_extension("commands.live")
         await self.add_cog(Sync(self))
         
         await self.tree.sync()
@@ -31,6 +39,11 @@ class MusicBot(commands.Bot):
         await super().close()
         if self.session:
             await self.session.close()
+        resolver.close()
+        image.shutdown()
+        history.close()
+        accounts.close()
+        cache.close()
 
 class Sync(commands.Cog):
     def __init__(self, bot):
@@ -61,5 +74,6 @@ bot = MusicBot()
 async def on_ready():
     print(f"[INFO] Logged in as {bot.user} ({bot.user.id})")
 
-# run bot
-bot.run(config.DISCORD_TOKEN)
+# run bot (guarded so render worker processes can import this module safely)
+if __name__ == "__main__":
+    bot.run(config.DISCORD_TOKEN)
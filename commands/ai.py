@@ -1,10 +1,105 @@
 import discord
+import asyncio
 from discord import app_commands
 from discord.ext import commands
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
 
 from google import genai
+from google.genai import errors, types
 import config
 from services.lastfm import get_now_playing
+from utils.accounts import accounts
+from utils.cache import cache, track_key
+from utils.scheduler import FairScheduler, SchedulerFull
+from utils.singleflight import SingleFlight
+from utils.ttlcache import TTLCache
+
+# gemini calls running at once (halved on a 429, then recovering), and how many may wait
+AI_CONCURRENCY = 4
+AI_QUEUE = 20
+# scheduler key shared by fact refills and chat summaries, so they queue like one user
+BACKGROUND = "background"
+BUSY = "⏳ Kairos has too many questions right now, try again in a minute."
+RATE_LIMITED = "⏳ Kairos is catching its breath (rate limited), try again shortly."
+
+# minimum seconds between progressive edits of a streamed reply (discord allows ~5 edits per 5s)
+STREAM_EDIT_INTERVAL = 1.2
+STREAM_CURSOR = " ▌"
+KAIROS_PROMPT = """You are Kairos. You have two distinct modes of response based on the user's input.
+
+MODE 1: IDENTITY & PERSONAL QUESTIONS (e.g., "Who are you?", "Are you AI?", "How are you?")
+- Behavior: You are an observing intelligence concerned with time, signal, and patterns.
+- Tone: Calm, minimal, cryptic, distant.
+- Constraint: IGNORE the "Current Music" context. Do not mention what the user is listening to.
+- Do NOT say anything like "MODE 1 activated" or mention it in any way.
+
+MODE 2: MUSIC KNOWLEDGE & FACTS (e.g., "Tell me about this artist", "Genre?", "Fun fact")
+- Behavior: Professional music analyst.
+- Tone: Brief, objective, precise, helpful.
+- Constraint: Drop the cryptic persona completely. Be direct and to the point. No fluff.
+- Do NOT say anything like "MODE 2 activated" or mention it in any way.
+
+Each user message starts with its Current Music Context.
+
+IMPORTANT: concise (under 800 chars). No markdown headers."""
+
+# /chat conversations: sessions kept, idle minutes before one is forgotten, and the
+# rough token budget for its turns before the oldest get folded into a summary
+CHAT_SESSIONS = 500
+CHAT_IDLE_MINUTES = 30
+CHAT_TOKEN_BUDGET = 3000
+# facts kept per track; they are served in turn and topped up in the background
+FUNFACT_POOL = 5
+
+async def stream_reply(interaction: discord.Interaction, stream: AsyncIterator,
+                       build: Callable[[str, bool], list[discord.Embed]]) -> str:
+    """
+    sends a model reply as it streams in, into the deferred original response (replacing
+    any queue notice there): it shows the first chunk right away and is then edited at most
+    every STREAM_EDIT_INTERVAL seconds, and once more when done.
+    build(text, done) turns the text so far into the embeds to show.
+    returns the full text.
+    """
+    loop = asyncio.get_running_loop()
+    text = ""
+    last_edit = None
+    async for chunk in stream:
+        if not chunk.text:
+            continue
+        text += chunk.text
+        if last_edit is None or loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+            await interaction.edit_original_response(content=None, embeds=build(text, False))
+            last_edit = loop.time()
+
+    await interaction.edit_original_response(content=None, embeds=build(text, True))
+    return text
+
+async def show_error(interaction: discord.Interaction, text: str):
+    """replaces the deferred response (queue notice or partial reply) with an error"""
+    await interaction.edit_original_response(content=text, embeds=[])
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 1
+
+class ChatSession:
+    """one user's /chat conversation: recent turns verbatim, older ones as a summary"""
+    def __init__(self):
+        self.turns: list[types.Content] = []
+        self.summary = ""
+        self.lock = asyncio.Lock()
+
+    @property
+    def tokens(self) -> int:
+        return _estimate_tokens(self.summary) + sum(_estimate_tokens(t.parts[0].text) for t in self.turns)
+
+    def config(self) -> types.GenerateContentConfig:
+        # the persona is sent as the system instruction, not repeated inside every prompt
+        instruction = KAIROS_PROMPT
+        if self.summary:
+            instruction += f"\n\nEarlier in this conversation: {self.summary}"
+        return types.GenerateContentConfig(system_instruction=instruction)
 
 class AI(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -14,17 +109,114 @@ class AI(commands.Cog):
             self.model_name = 'gemini-2.5-flash-lite'
         else:
             self.client = None
+        # next pool index per track, and one background fact generation per track at a time
+        self._fact_turns = TTLCache(maxsize=4096, ttl=24 * 3600)
+        self._fact_fills = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+        self.scheduler = FairScheduler(max_concurrent=AI_CONCURRENCY, max_queued=AI_QUEUE)
+        # re-set on every message, so the ttl works as an idle timeout
+        self._sessions = TTLCache(maxsize=CHAT_SESSIONS, ttl=CHAT_IDLE_MINUTES * 60)
 
-    async def _get_context(self):
-        """helper to get current listening context"""
+    @asynccontextmanager
+    async def _model_slot(self, key, interaction: discord.Interaction = None):
+        """
+        a scheduler slot for one model call. raises SchedulerFull when the queue is too deep,
+        tells the user their place in line if they have to wait, and throttles on a 429.
+        """
+        async def queued(position: int):
+            # shown in the deferred response itself, which the reply then replaces
+            if interaction:
+                try:
+                    await interaction.edit_original_response(content=f"⏳ Kairos is busy, you're #{position} in line.")
+                except discord.HTTPException:
+                    pass
+
+        async with self.scheduler.slot(key, on_queued=queued):
+            try:
+                yield
+            except errors.APIError as e:
+                if e.code == 429:
+                    self.scheduler.throttle()
+                raise
+
+    async def _get_context(self, discord_id: int):
+        """helper to get the user's current listening context"""
         try:
-            data = await get_now_playing(self.bot.session)
+            user = await accounts.username_for(discord_id)
+            if not user:
+                return None
+            data = await get_now_playing(self.bot.session, user)
             if data and data.get("now_playing"):
                 return data
         except Exception:
             pass
         return None
 
+    def _fact_prompt(self, track: str, artist: str, known: list[str] = ()) -> str:
+        prompt = f"Tell me a short, interesting fun fact about the song '{track}' by '{artist}'. If specific song facts aren't available, tell me a fact about the artist. Keep it under 280 characters."
+        if known:
+            prompt += " Don't repeat any of these facts:\n" + "\n".join(f"- {fact}" for fact in known)
+        return prompt
+
+    async def _store_fact(self, artist: str, track: str, fact: str):
+        # re-read so facts added meanwhile (and the track's other fields) are kept
+        key = track_key(artist, track)
+        entry = await cache.get(key) or {}
+        facts = entry.get("funfacts", [])
+        if fact and fact not in facts:
+            await cache.set(key, {**entry, "funfacts": (facts + [fact])[-FUNFACT_POOL:]})
+
+    async def _fill_fact(self, artist: str, track: str, known: list[str]):
+        async with self._model_slot(BACKGROUND):
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name, contents=self._fact_prompt(track, artist, known)
+            )
+        await self._store_fact(artist, track, (response.text or "").strip())
+
+    def _top_up_facts(self, artist: str, track: str, known: list[str]):
+        """generates one more pool entry in the background, unless one is already underway"""
+        key = track_key(artist, track)
+        if key in self._fact_fills:
+            return
+
+        async def fill():
+            try:
+                await self._fact_fills.do(key, lambda: self._fill_fact(artist, track, known))
+            except SchedulerFull:
+                pass # busy, a later /funfact tries again
+            except Exception as e:
+                print(f"[ERROR] Fun fact refill failed for {key}: {e}")
+
+        task = asyncio.create_task(fill())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _session_for(self, discord_id: int, fresh: bool = False) -> ChatSession:
+        session = None if fresh else self._sessions.get(discord_id)
+        if session is None:
+            session = ChatSession()
+        self._sessions.set(discord_id, session)
+        return session
+
+    async def _trim(self, session: ChatSession):
+        """folds the oldest turns into the summary until the session fits its token budget"""
+        # the older half goes, in whole user/model pairs, but the latest exchange always stays verbatim
+        cut = min(len(session.turns) - 2, max(2, len(session.turns) // 4 * 2))
+        if session.tokens <= CHAT_TOKEN_BUDGET or cut <= 0:
+            return
+        old, session.turns = session.turns[:cut], session.turns[cut:]
+        transcript = "\n".join(f"{t.role}: {t.parts[0].text}" for t in old)
+        try:
+            async with self._model_slot(BACKGROUND):
+                response = await self.client.aio.models.generate_content(
+                    model=self.model_name,
+                    contents=f"Summarize this conversation in under 400 characters, keeping names and facts.\n"
+                             f"Earlier summary: {session.summary or 'None.'}\n\n{transcript}"
+                )
+            session.summary = (response.text or "").strip()[:1600]
+        except Exception as e:
+            print(f"[ERROR] Chat summary failed, dropping old turns: {e}")
+
     @app_commands.command(name="funfact", description="Get a fun fact about what's playing (or music in general)")
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
@@ -35,102 +227,109 @@ class AI(commands.Cog):
             await interaction.followup.send("❌ Gemini API Key is missing.", ephemeral=True)
             return
 
-        context = await self._get_context()
+        context = await self._get_context(interaction.user.id)
+        facts = []
         
         if context:
             track = context['track']
             artist = context['artist']
-            prompt = f"Tell me a short, interesting fun fact about the song '{track}' by '{artist}'. If specific song facts aren't available, tell me a fact about the artist. Keep it under 280 characters."
+            prompt = self._fact_prompt(track, artist)
+            facts = (await cache.get(track_key(artist, track)) or {}).get("funfacts", [])
         else:
             prompt = "Tell me a random, mind-blowing fun fact about music history. Keep it under 280 characters."
 
-        try:
-            # generate valid response content
-            response = await self.bot.loop.run_in_executor(
-                None, 
-                lambda: self.client.models.generate_content(
-                    model=self.model_name, 
-                    contents=prompt
-                )
-            )
-            fact = response.text
-            
-            embed = discord.Embed(title="💡 Did you know?", description=fact, color=0xFFD700)
+        def build(fact: str, done: bool) -> list[discord.Embed]:
+            embed = discord.Embed(title="💡 Did you know?", description=fact if done else fact + STREAM_CURSOR, color=0xFFD700)
             if context:
                 embed.add_field(name="Context", value=f"{context['track']} - {context['artist']}", inline=False)
             
             embed.set_footer(text="Generated by silicon. Consume responsibly.")
-            
-            await interaction.followup.send(embed=embed)
+            return [embed]
+
+        if facts:
+            # cached pool: answer right away, rotating through it. turn counts facts shown.
+            # the pool only grows once every fact has been shown, so no request costs more
+            # than the one call it used to.
+            turn = self._fact_turns.get(track_key(artist, track), 0)
+            await interaction.followup.send(embeds=build(facts[turn % len(facts)], True))
+            if turn < len(facts) or len(facts) >= FUNFACT_POOL:
+                self._fact_turns.set(track_key(artist, track), turn + 1)
+            else:
+                # all seen: this one was a repeat, the next request gets the new fact at index len
+                self._fact_turns.set(track_key(artist, track), len(facts))
+                self._top_up_facts(artist, track, facts)
+            return
+
+        try:
+            # native async client, streamed so the first words show up right away
+            async with self._model_slot(interaction.user.id, interaction):
+                stream = await self.client.aio.models.generate_content_stream(model=self.model_name, contents=prompt)
+                fact = await stream_reply(interaction, stream, build)
+            if context:
+                await self._store_fact(artist, track, fact.strip())
+                # this fact was just shown, the next request repeats it and starts a refill
+                self._fact_turns.set(track_key(artist, track), 1)
+        except SchedulerFull:
+            await show_error(interaction, BUSY)
+        except errors.APIError as e:
+            await show_error(interaction, RATE_LIMITED if e.code == 429 else f"❌ Brain freeze: {str(e)}")
         except Exception as e:
-            await interaction.followup.send(f"❌ Brain freeze: {str(e)}", ephemeral=True)
+            await show_error(interaction, f"❌ Brain freeze: {str(e)}")
 
     @app_commands.command(name="chat", description="Chat with Kairos about music")
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-    async def chat(self, interaction: discord.Interaction, message: str):
+    @app_commands.describe(new="Start a fresh conversation instead of continuing the last one")
+    async def chat(self, interaction: discord.Interaction, message: str, new: bool = False):
         await interaction.response.defer()
 
         if not self.client:
             await interaction.followup.send("❌ Gemini API Key is missing.", ephemeral=True)
             return
 
-        context = await self._get_context()
+        context = await self._get_context(interaction.user.id)
         
-        system_prompt = """You are Kairos. You have two distinct modes of response based on the user's input.
+        session = self._session_for(interaction.user.id, fresh=new)
 
-MODE 1: IDENTITY & PERSONAL QUESTIONS (e.g., "Who are you?", "Are you AI?", "How are you?")
-- Behavior: You are an observing intelligence concerned with time, signal, and patterns.
-- Tone: Calm, minimal, cryptic, distant.
-- Constraint: IGNORE the "Current Music" context. Do not mention what the user is listening to.
-- Do NOT say anything like "MODE 1 activated" or mention it in any way.
+        # the music context changes between turns, so it rides along with the question
+        music = f"User is listening to: '{context['track']}' by '{context['artist']}'." if context else "None."
+        turn = types.Content(role="user", parts=[types.Part(text=f"Current Music Context: {music}\nUser Question: {message}")])
 
-MODE 2: MUSIC KNOWLEDGE & FACTS (e.g., "Tell me about this artist", "Genre?", "Fun fact")
-- Behavior: Professional music analyst.
-- Tone: Brief, objective, precise, helpful.
-- Constraint: Drop the cryptic persona completely. Be direct and to the point. No fluff.
-- Do NOT say anything like "MODE 2 activated" or mention it in any way.
+        # embed 1: user question
+        user_embed = discord.Embed(color=0x2b2d31) # dark grey/clean
+        user_embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
+        user_embed.description = f"**{message}**"
 
-Current Music Context:
-"""
+        # context & disclaimer on bot embed
+        footer_text = "Generated by silicon. Consume responsibly."
         if context:
-            system_prompt += f"User is listening to: '{context['track']}' by '{context['artist']}'."
-        else:
-            system_prompt += "None."
-
-        full_prompt = f"{system_prompt}\n\nIMPORTANT: concise (under 800 chars). No markdown headers.\nUser Question: {message}\nAnswer:"
-
-        try:
-            response = await self.bot.loop.run_in_executor(
-                None, 
-                lambda: self.client.models.generate_content(
-                    model=self.model_name, 
-                    contents=full_prompt
-                )
-            )
-            text = response.text[:1024]
-            
-            # embed 1: user question
-            user_embed = discord.Embed(color=0x2b2d31) # dark grey/clean
-            user_embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-            user_embed.description = f"**{message}**"
+            footer_text = f"Listening to: {context['track']} • " + footer_text
 
+        def build(text: str, done: bool) -> list[discord.Embed]:
             # embed 2: kairos answer
             bot_embed = discord.Embed(color=0x78909c) # kairos theme
             bot_embed.set_author(name="Kairos", icon_url=self.bot.user.display_avatar.url)
-            bot_embed.description = text
-            
-            # context & disclaimer on bot embed
-            footer_text = "Generated by silicon. Consume responsibly."
-            if context:
-                footer_text = f"Listening to: {context['track']} • " + footer_text
-            
+            bot_embed.description = text[:1024] if done else text[:1024] + STREAM_CURSOR
             bot_embed.set_footer(text=footer_text)
-            
             # send both embeds
-            await interaction.followup.send(embeds=[user_embed, bot_embed])
+            return [user_embed, bot_embed]
+
+        try:
+            # one exchange at a time per user, so turns stay in order
+            async with session.lock:
+                async with self._model_slot(interaction.user.id, interaction):
+                    stream = await self.client.aio.models.generate_content_stream(
+                        model=self.model_name, contents=session.turns + [turn], config=session.config()
+                    )
+                    text = await stream_reply(interaction, stream, build)
+                session.turns += [turn, types.Content(role="model", parts=[types.Part(text=text)])]
+                await self._trim(session)
+        except SchedulerFull:
+            await show_error(interaction, BUSY)
+        except errors.APIError as e:
+            await show_error(interaction, RATE_LIMITED if e.code == 429 else f"❌ I'm having trouble thinking: {str(e)}")
         except Exception as e:
-            await interaction.followup.send(f"❌ I'm having trouble thinking: {str(e)}", ephemeral=True)
+            await show_error(interaction, f"❌ I'm having trouble thinking: {str(e)}")
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(AI(bot))
@@ -4,11 +4,39 @@ from discord.ext import commands
 from typing import Literal
 from io import BytesIO
 
-from services.lastfm import get_top_items, get_weekly_track_chart, get_album_art
-from utils.image import create_collage
+import asyncio
+import datetime
+import time
+
+from services.lastfm import get_top_items, get_top_items_paged, get_album_art, sized_image_url, force_hd_url
+from services.history import history
+from utils.accounts import accounts, NOT_LINKED
+from utils.cache import cache, album_key
+from utils.image import create_collage, collage_cache, OUTPUT_FORMATS, render_bar_chart, render_heatmap
 
 
 Period = Literal["7day", "1month", "3month", "6month", "12month", "overall"]
+GridSize = Literal["3x3", "4x4", "5x5", "6x6", "8x8", "10x10"]
+
+# period lengths for answering /top from the local history (0 = everything)
+PERIOD_SECONDS = {
+    "7day": 7 * 86400,
+    "1month": 30 * 86400,
+    "3month": 90 * 86400,
+    "6month": 180 * 86400,
+    "12month": 365 * 86400,
+    "overall": 0,
+}
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# simultaneous album.getinfo lookups for albums the top list has no art for
+MAX_ART_LOOKUPS = 5
+
+def _date_ts(text: str) -> int:
+    """YYYY-MM-DD -> unix timestamp at utc midnight"""
+    day = datetime.date.fromisoformat(text)
+    return int(datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc).timestamp())
 
 class ChartCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -17,18 +45,43 @@ class ChartCommands(commands.Cog):
     @app_commands.command(name="top", description="View your top artists, albums, or tracks")
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    @app_commands.describe(start="custom range start, YYYY-MM-DD (overrides period)", end="custom range end, YYYY-MM-DD (exclusive)")
     async def top(self, interaction: discord.Interaction, 
                   category: Literal["artists", "albums", "tracks"], 
-                  period: Period = "7day"):
+                  period: Period = "7day", start: str = None, end: str = None):
         await interaction.response.defer()
         
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
         method_map = {
             "artists": "user.gettopartists",
             "albums": "user.gettopalbums",
             "tracks": "user.gettoptracks"
         }
-        
-        items = await get_top_items(self.bot.session, period, method_map[category], limit=10)
+
+        if start or end:
+            # custom ranges only exist locally, last.fm only knows the fixed periods
+            try:
+                start_ts = _date_ts(start) if start else 0
+                end_ts = _date_ts(end) if end else None
+            except ValueError:
+                await interaction.followup.send("❌ Dates must look like 2024-01-31.", ephemeral=True)
+                return
+            items = await self._local_top(user, category, start_ts, end_ts, limit=10)
+            if items is None:
+                await interaction.followup.send("❌ Your history is still syncing, custom ranges will work once it's done.", ephemeral=True)
+                return
+            period = f"{start or 'start'} → {end or 'now'}"
+        else:
+            # answer from the local history once it's fully synced, else ask last.fm
+            seconds = PERIOD_SECONDS[period]
+            start_ts = int(time.time()) - seconds if seconds else 0
+            items = await self._local_top(user, category, start_ts, None, limit=10)
+            if items is None:
+                items = await get_top_items(self.bot.session, user, period, method_map[category], limit=10)
         if not items:
             await interaction.followup.send(f"❌ No data found for top {category}.", ephemeral=True)
             return
@@ -51,37 +104,181 @@ class ChartCommands(commands.Cog):
     @app_commands.command(name="collage", description="Generate a collage of your top albums")
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-    async def collage(self, interaction: discord.Interaction, size: Literal["3x3", "5x5"] = "3x3", period: Period = "7day"):
+    @app_commands.rename(image_format="format")
+    @app_commands.describe(image_format="jpeg/webp upload faster, png is lossless", quality="jpeg/webp quality (10-100)")
+    async def collage(self, interaction: discord.Interaction, size: GridSize = "3x3", period: Period = "7day",
+                      image_format: Literal["jpeg", "webp", "png"] = "jpeg", quality: app_commands.Range[int, 10, 100] = 90):
         await interaction.response.defer()
         
-        grid_size = int(size[0]) # '3' or '5'
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
+        grid_size = int(size.split("x")[0]) # '3' .. '10'
         limit = grid_size * grid_size
         
-        albums = await get_top_items(self.bot.session, period, "user.gettopalbums", limit=limit)
+        albums = await get_top_items_paged(self.bot.session, user, period, "user.gettopalbums", total=limit)
         if not albums:
             await interaction.followup.send("❌ Not enough top albums to generate a collage.", ephemeral=True)
             return
             
-        # Extract image URLs (largest size usually last)
-        img_urls = []
-        for album in albums:
-            imgs = album.get("image", [])
-            url = imgs[-1]["#text"] if imgs else ""
-            img_urls.append(url)
+        img_urls = await self._album_image_urls(albums)
             
-        # Generate image
-        image_bytes = await create_collage(self.bot.session, img_urls, grid_size)
-        
-        if not image_bytes:
-             await interaction.followup.send("❌ Failed to generate collage.", ephemeral=True)
-             return
-             
-        file = discord.File(fp=image_bytes, filename="collage.png")
+        # Re-send the stored render if the top list hasn't changed since last time
+        _, ext = OUTPUT_FORMATS[image_format]
+        if image_format == "png":
+            quality = 0 # not used, keep the cache key stable
+        result_key = "\n".join([period, str(grid_size), image_format, str(quality), *img_urls])
+        stored = await collage_cache.get(result_key, suffix=f".{ext}")
+
+        if stored:
+            image_bytes = BytesIO(stored)
+        else:
+            # Generate image
+            image_bytes, colors = await create_collage(self.bot.session, img_urls, grid_size, image_format, quality)
+
+            if not image_bytes:
+                 await interaction.followup.send("❌ Failed to generate collage.", ephemeral=True)
+                 return
+
+            await collage_cache.set(result_key, image_bytes.getvalue(), suffix=f".{ext}")
+            await self._store_album_colors(albums, img_urls, colors)
+
+        filename = f"collage.{ext}"
+        file = discord.File(fp=image_bytes, filename=filename)
         embed = discord.Embed(title=f"Top Albums Collage ({period})", color=0xba0000)
-        embed.set_image(url="attachment://collage.png")
+        embed.set_image(url=f"attachment://{filename}")
         
         await interaction.followup.send(embed=embed, file=file)
 
+    @app_commands.command(name="timeline", description="Chart when you listen, by hour, weekday or day")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    @app_commands.describe(days="how far back to look", utc_offset="your timezone as hours from UTC, e.g. 5.5")
+    async def timeline(self, interaction: discord.Interaction, by: Literal["hour", "weekday", "day"] = "day",
+                       days: app_commands.Range[int, 1, 3650] = 30, utc_offset: app_commands.Range[float, -12.0, 14.0] = 0.0):
+        await interaction.response.defer()
+
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
+        # rendered purely from the local history, no last.fm calls
+        index = await history.index(user)
+        if index is None:
+            await interaction.followup.send("❌ Your history is still syncing, try again once it's done.", ephemeral=True)
+            return
+
+        now = int(time.time())
+        start = now - days * 86400
+        offset = int(utc_offset * 3600)
+
+        if by == "hour":
+            values = index.by_hour(start, None, offset)
+            labels = [f"{h:02}" for h in range(24)]
+        elif by == "weekday":
+            values = index.by_weekday(start, None, offset)
+            labels = WEEKDAYS
+        else:
+            values = index.by_day(start, now, offset)
+            # roughly a dozen date labels whatever the range
+            first_day = (start + offset) // 86400
+            step = max(1, len(values) // 12)
+            labels = [
+                datetime.datetime.fromtimestamp((first_day + i) * 86400, datetime.timezone.utc).strftime("%b %d")
+                if i % step == 0 else ""
+                for i in range(len(values))
+            ]
+
+        image = await render_bar_chart(values.tolist(), labels, f"Scrobbles by {by}, last {days} days")
+        file = discord.File(fp=image, filename="timeline.png")
+        embed = discord.Embed(title=f"Listening Timeline ({int(values.sum())} scrobbles)", color=0xba0000)
+        embed.set_image(url="attachment://timeline.png")
+        await interaction.followup.send(embed=embed, file=file)
+
+    @app_commands.command(name="heatmap", description="Heatmap of your listening by weekday and hour")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    @app_commands.describe(days="how far back to look", utc_offset="your timezone as hours from UTC, e.g. 5.5")
+    async def heatmap(self, interaction: discord.Interaction, days: app_commands.Range[int, 1, 3650] = 365,
+                      utc_offset: app_commands.Range[float, -12.0, 14.0] = 0.0):
+        await interaction.response.defer()
+
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
+        index = await history.index(user)
+        if index is None:
+            await interaction.followup.send("❌ Your history is still syncing, try again once it's done.", ephemeral=True)
+            return
+
+        start = int(time.time()) - days * 86400
+        grid = index.heatmap(start, None, int(utc_offset * 3600))
+
+        image = await render_heatmap(grid.tolist(), WEEKDAYS, f"Weekday x hour, last {days} days")
+        file = discord.File(fp=image, filename="heatmap.png")
+        embed = discord.Embed(title=f"Listening Heatmap ({int(grid.sum())} scrobbles)", color=0xba0000)
+        embed.set_image(url="attachment://heatmap.png")
+        await interaction.followup.send(embed=embed, file=file)
+
+    async def _local_top(self, user: str, category: str, start: int, end: int | None, limit: int) -> list[dict] | None:
+        """
+        top items in [start, end) from the user's local history index, shaped like
+        the last.fm api items. None if the history isn't complete yet.
+        """
+        index = await history.index(user)
+        if index is None:
+            return None
+
+        rows = index.top(category, start, end, limit)
+        name_column = {"artists": "artist", "albums": "album", "tracks": "track"}[category]
+        return [
+            {"name": row[name_column], "playcount": str(row["plays"]), "artist": {"name": row["artist"]}}
+            for row in rows
+        ]
+
+    async def _album_image_urls(self, albums: list[dict]) -> list[str]:
+        """
+        tile-sized art url per album (largest size is usually last).
+        albums the top list has no art for are looked up in parallel, a few at a time.
+        """
+        lookups = asyncio.Semaphore(MAX_ART_LOOKUPS)
+
+        async def image_url(album):
+            imgs = album.get("image", [])
+            url = imgs[-1]["#text"] if imgs else ""
+            artist = album.get("artist", {}).get("name")
+            if not url and artist and album.get("name"):
+                cached = await cache.get(album_key(artist, album["name"])) or {}
+                url = cached.get("album_art")
+                if not url:
+                    async with lookups:
+                        url = await get_album_art(self.bot.session, artist, album["name"])
+            # pinned to the tile-sized variant
+            return sized_image_url(url or "", "300x300")
+
+        return list(await asyncio.gather(*(image_url(album) for album in albums)))
+
+    async def _store_album_colors(self, albums: list[dict], img_urls: list[str], colors: list[int | None]):
+        """
+        keeps the colors the collage computed anyway, so /nowplaying on any of
+        these albums needs no image download
+        """
+        for album, url, color in zip(albums, img_urls, colors):
+            artist = album.get("artist", {}).get("name")
+            if not (artist and album.get("name") and url and color is not None):
+                continue
+            key = album_key(artist, album["name"])
+            entry = await cache.get(key) or {}
+            if entry.get("color") is None:
+                entry.setdefault("album_art", force_hd_url(url))
+                entry["color"] = color
+                await cache.set(key, entry)
+
 
 
 async def setup(bot: commands.Bot):
@@ -1,15 +1,23 @@
 import discord
-from discord.ext import commands
-import aiohttp
+from discord.ext import commands, tasks
 import re
 import time
 import datetime
 
+from utils import upstream
+from utils.singleflight import SingleFlight
+
+_DIGIT = re.compile(r"\d")
+# conversions answered per message
+MAX_CONVERSIONS = 5
+
 class Currency(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.rates = {}
+        self.cross_rates: dict[str, dict[str, float]] = {}
         self.last_updated = 0
+        self._inflight = SingleFlight()
         self.cache_duration = 3600  # 1 hour cache
         # Regex
         # (?i) flag is handled by re.IGNORECASE
@@ -36,65 +44,82 @@ class Currency(commands.Cog):
             "LKR": "Sri Lankan Rupee", "UAH": "Ukrainian Hryvnia", "NGN": "Nigerian Naira"
         }
 
+    async def cog_load(self):
+        self.refresh_rates.start()
+
+    async def cog_unload(self):
+        self.refresh_rates.cancel()
+
+    async def _fetch_rates(self):
+        try:
+            data = await upstream.get_json(self.bot.session, "https://api.exchangerate-api.com/v4/latest/USD")
+            if data and data.get("rates"):
+                self.rates = data["rates"]
+                # rate is "1 USD = x CURR", so 1 FROM = rates[TO] / rates[FROM] TO
+                self.cross_rates = {
+                    src: {dst: dst_rate / src_rate for dst, dst_rate in self.rates.items()}
+                    for src, src_rate in self.rates.items() if src_rate
+                }
+                self.last_updated = time.time()
+            else:
+                print("[ERROR] Failed to fetch currency rates")
+        except Exception as e:
+            print(f"[ERROR] Exception fetching currency rates: {e}")
+        return self.rates
+
     async def get_rates(self):
-        current_time = time.time()
-        if not self.rates or (current_time - self.last_updated) > self.cache_duration:
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get("https://api.exchangerate-api.com/v4/latest/USD") as resp:
-                        if resp.status == 200:
-                            data = await resp.json()
-                            self.rates = data.get("rates", {})
-                            self.last_updated = current_time
-                        else:
-                            print(f"[ERROR] Failed to fetch currency rates: {resp.status}")
-                except Exception as e:
-                    print(f"[ERROR] Exception fetching currency rates: {e}")
+        if not self.rates or (time.time() - self.last_updated) > self.cache_duration:
+            # concurrent callers share one fetch
+            await self._inflight.do("rates", self._fetch_rates)
         return self.rates
 
+    # checks often so a failed fetch is retried soon, but only fetches once the rates are stale
+    @tasks.loop(minutes=10)
+    async def refresh_rates(self):
+        await self.get_rates()
+
+    @refresh_rates.before_loop
+    async def before_refresh_rates(self):
+        await self.bot.wait_until_ready()
+
+    def _might_convert(self, content: str) -> bool:
+        """cheap check that skips the regex for the vast majority of messages"""
+        if len(content) < 8 or not _DIGIT.search(content):
+            return False
+        lowered = content.lower()
+        return "to" in lowered or "in" in lowered
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        if message.author.bot or not self._might_convert(message.content):
             return
 
-        # Check for matches
-        match = self.pattern.search(message.content)
-        if match:
+        # conversions only ever read the precomputed table, never wait on a fetch
+        if not self.cross_rates:
+            return # Can't convert without rates
+
+        lines = []
+        for match in self.pattern.finditer(message.content):
             amount_str, from_curr, to_curr = match.groups()
-            
-            try:
-                amount = float(amount_str)
-                from_curr = from_curr.upper()
-                to_curr = to_curr.upper()
-
-                rates = await self.get_rates()
-                
-                if not rates:
-                    return # Can't convert without rates
-
-                if from_curr not in rates or to_curr not in rates:
-                    # Silently ignore invalid currencies to avoid spamming
-                    return
-
-                # Convert to USD first (base), then to target
-                # rate is "1 USD = x CURR"
-                
-                # Formula: amount_in_usd = amount / rate_from
-                #          amount_in_target = amount_in_usd * rate_to
-                
-                rate_from = rates.get(from_curr)
-                rate_to = rates.get(to_curr)
-                
-                if rate_from and rate_to:
-                    converted_amount = (amount / rate_from) * rate_to
-                    
-                    # Get full names or fallback to code
-                    from_name = self.currency_names.get(from_curr, from_curr)
-                    to_name = self.currency_names.get(to_curr, to_curr)
-
-                    # Format output
-                    await message.reply(f"{amount:,.2f} {from_name} ≈ {converted_amount:,.2f} {to_name}")
+            from_curr = from_curr.upper()
+            to_curr = to_curr.upper()
 
+            rate = self.cross_rates.get(from_curr, {}).get(to_curr)
+            if rate is None:
+                # Silently ignore invalid currencies to avoid spamming
+                continue
+
+            amount = float(amount_str)
+            # Get full names or fallback to code
+            from_name = self.currency_names.get(from_curr, from_curr)
+            to_name = self.currency_names.get(to_curr, to_curr)
+            lines.append(f"{amount:,.2f} {from_name} ≈ {amount * rate:,.2f} {to_name}")
+            if len(lines) == MAX_CONVERSIONS:
+                break
+
+        if lines:
+            try:
+                await message.reply("\n".join(lines))
             except Exception as e:
                 print(f"[ERROR] Currency conversion error: {e}")
 
@@ -0,0 +1,61 @@
+import asyncio
+from discord.ext import commands, tasks
+
+import config
+from services.history import history, sync
+from utils import upstream
+from utils.accounts import accounts
+
+# how often a batch of accounts gets its new scrobbles pulled into the local history
+SYNC_MINUTES = 2
+# accounts synced per tick, and how many of those run at once.
+# with thousands of linked users every account still comes round regularly
+# without a burst of last.fm traffic.
+SYNC_BATCH = 50
+SYNC_CONCURRENCY = 4
+
+class HistorySync(commands.Cog):
+    """keeps the local scrobble history (services.history) current in the background"""
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._cursor = "" # last username synced, accounts are walked in name order
+        self.sync_history.start()
+
+    def cog_unload(self):
+        self.sync_history.cancel()
+
+    async def _next_batch(self) -> list[str]:
+        users = await accounts.usernames(after=self._cursor, limit=SYNC_BATCH)
+        if len(users) < SYNC_BATCH:
+            # wrapped around, the next tick starts from the top again
+            self._cursor = ""
+            if config.LASTFM_USERNAME and config.LASTFM_USERNAME not in users:
+                users.append(config.LASTFM_USERNAME)
+        else:
+            self._cursor = users[-1]
+        return users
+
+    @tasks.loop(minutes=SYNC_MINUTES)
+    async def sync_history(self):
+        slots = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+        async def sync_user(user):
+            async with slots:
+                try:
+                    fetched = await sync(self.bot.session, history, user)
+                    if fetched:
+                        print(f"[INFO] History sync stored {fetched} scrobbles for {user}")
+                except Exception as e:
+                    print(f"[ERROR] History sync failed for {user}: {e}")
+
+        users = await self._next_batch()
+        # paced as background traffic, so /nowplaying etc. don't wait behind sync pages
+        with upstream.background():
+            await asyncio.gather(*(sync_user(user) for user in users))
+
+    @sync_history.before_loop
+    async def before_sync_history(self):
+        await self.bot.wait_until_ready()
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(HistorySync(bot))
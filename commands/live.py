@@ -0,0 +1,165 @@
+import time
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+from typing import Literal
+
+from commands.nowplaying import build_nowplaying_embed
+from services.lastfm import get_now_playing, get_album_art
+from services.poller import NowPlayingPoller
+from services.prefetch import Prefetcher
+from utils.accounts import accounts, NOT_LINKED
+from utils.cache import cache, track_key, album_key
+
+# panels stop updating after this long, so forgotten ones don't poll forever
+LIVE_HOURS = 6
+# discord allows roughly 5 edits per 5s per channel; stay under it and cap the total
+CHANNEL_EDIT_GAP = 1.2
+EDITS_PER_TICK = 5
+EDIT_TICK_SECONDS = 0.5
+
+class LivePanel:
+    __slots__ = ("owner_id", "user", "message", "expires")
+
+    def __init__(self, owner_id: int, user: str, message: discord.Message):
+        self.owner_id = owner_id
+        self.user = user
+        self.message = message
+        self.expires = time.monotonic() + LIVE_HOURS * 3600
+
+class Live(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.poller = NowPlayingPoller(lambda: self.bot.session)
+        # warm art, color, youtube and lyrics for new tracks before anyone asks for them
+        self.prefetcher = Prefetcher(lambda: self.bot.session)
+        self.poller.add_listener(self.prefetcher.on_track_change)
+        self.poller.add_listener(self._on_track_change)
+        self.panels: dict[int, LivePanel] = {}     # owner discord id -> panel
+        self.watchers: dict[str, set[int]] = {}    # last.fm user -> owner ids
+        # latest pending embed per message; a newer track replaces an unsent edit
+        self._pending: dict[int, tuple[LivePanel, discord.Embed]] = {}
+        self._channel_free_at: dict[int, float] = {}
+
+    async def cog_load(self):
+        self.prefetcher.start()
+        self.poller.start()
+        self.flush_edits.start()
+        self.expire_panels.start()
+
+    async def cog_unload(self):
+        self.poller.stop()
+        self.prefetcher.stop()
+        self.flush_edits.cancel()
+        self.expire_panels.cancel()
+
+    async def _build_embed(self, data: dict) -> discord.Embed:
+        """now playing embed from cached art/color only, falling back to one art lookup"""
+        artist, album, track = data["artist"], data["album"], data["track"]
+        art_cached = await cache.get(album_key(artist, album) if album else track_key(artist, track)) or {}
+        album_art = art_cached.get("album_art") or await get_album_art(self.bot.session, artist, album, track)
+
+        embed = build_nowplaying_embed(data, album_art, art_cached.get("color"), None)
+        embed.set_footer(text="🔴 Live • updates when the track changes")
+        return embed
+
+    def _start(self, panel: LivePanel):
+        self._stop(panel.owner_id)
+        self.panels[panel.owner_id] = panel
+        self.watchers.setdefault(panel.user, set()).add(panel.owner_id)
+        self.poller.watch(panel.user)
+
+    def _stop(self, owner_id: int) -> LivePanel | None:
+        panel = self.panels.pop(owner_id, None)
+        if panel is None:
+            return None
+        owners = self.watchers.get(panel.user, set())
+        owners.discard(owner_id)
+        if not owners:
+            self.watchers.pop(panel.user, None)
+        self._pending.pop(panel.message.id, None)
+        self.poller.unwatch(panel.user)
+        return panel
+
+    async def _on_track_change(self, user: str, data: dict):
+        owners = self.watchers.get(user)
+        if not owners:
+            return
+        # one embed per track change, shared by every panel watching this user
+        embed = await self._build_embed(data)
+        # panels may have stopped while the embed was built
+        for owner_id in list(self.watchers.get(user, ())):
+            panel = self.panels[owner_id]
+            self._pending[panel.message.id] = (panel, embed)
+
+    @tasks.loop(seconds=EDIT_TICK_SECONDS)
+    async def flush_edits(self):
+        now = time.monotonic()
+        sent = 0
+        for message_id in list(self._pending):
+            if sent >= EDITS_PER_TICK:
+                break
+            # re-read: edits awaited below can overlap a stop or a newer track change
+            entry = self._pending.get(message_id)
+            if entry is None:
+                continue
+            panel, _ = entry
+            channel_id = panel.message.channel.id
+            if self._channel_free_at.get(channel_id, 0) > now:
+                continue # this channel had an edit recently, keep it queued
+
+            panel, embed = self._pending.pop(message_id)
+            self._channel_free_at[channel_id] = now + CHANNEL_EDIT_GAP
+            sent += 1
+            try:
+                await panel.message.edit(embed=embed)
+            except discord.NotFound:
+                self._stop(panel.owner_id) # panel deleted
+            except Exception as e:
+                # one bad edit must not end the loop for every panel
+                print(f"[ERROR] Live panel edit failed: {e}")
+
+    @tasks.loop(minutes=1)
+    async def expire_panels(self):
+        now = time.monotonic()
+        for owner_id, panel in list(self.panels.items()):
+            if panel.expires <= now:
+                self._stop(owner_id)
+        # forget rate limit marks for channels that are long free
+        self._channel_free_at = {c: t for c, t in self._channel_free_at.items() if t > now}
+
+    @app_commands.command(name="live", description="Post a now playing panel that updates itself")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    async def live(self, interaction: discord.Interaction, action: Literal["start", "stop"] = "start"):
+        await interaction.response.defer(ephemeral=True)
+
+        if action == "stop":
+            if self._stop(interaction.user.id):
+                await interaction.followup.send("⏹️ Live panel stopped.", ephemeral=True)
+            else:
+                await interaction.followup.send("❌ You don't have a live panel running.", ephemeral=True)
+            return
+
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
+        data = await get_now_playing(self.bot.session, user)
+        if not data:
+            await interaction.followup.send("❌ Could not fetch now playing data.", ephemeral=True)
+            return
+
+        # a regular channel message stays editable, an interaction reply only for 15 minutes
+        try:
+            message = await interaction.channel.send(embed=await self._build_embed(data))
+        except (discord.HTTPException, AttributeError):
+            await interaction.followup.send("❌ Live panels need the bot to be able to post in this channel.", ephemeral=True)
+            return
+
+        self._start(LivePanel(interaction.user.id, user, message))
+        await interaction.followup.send(f"🔴 Live panel started for {LIVE_HOURS} hours. Use `/live stop` to end it.", ephemeral=True)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Live(bot))
@@ -1,14 +1,29 @@
 import discord
+import asyncio
 from discord import app_commands
 from discord.ext import commands
+from urllib.parse import quote
 
-
-from services.lastfm import get_now_playing, get_album_art, get_track_playcount
+from services.lastfm import get_now_playing, get_album_art, get_track_playcount, sized_image_url
 from services.lyrics import get_lyrics
 from services.youtube import get_youtube_link
-from utils.cache import cache
+from utils.accounts import accounts, NOT_LINKED
+from utils.cache import cache, track_key, album_key
 from utils.image import get_dominant_color
 
+DEFAULT_COLOR = 0x2F3136
+
+# seconds each /nowplaying stage may take before the embed goes out without it.
+# the color budget starts once the album art is known.
+STAGE_TIMEOUTS = {
+    "album_art": 4.0,
+    "color": 2.0,
+    "playcount": 3.0,
+    "youtube": 2.5,
+}
+# how long late stages may keep running to be edited into the sent message
+LATE_TIMEOUT = 30.0
+
 class NowPlayingView(discord.ui.View):
     def __init__(self, bot, youtube_link, track, artist):
         super().__init__(timeout=None)
@@ -26,7 +41,7 @@ class NowPlayingView(discord.ui.View):
         await interaction.response.send_message("🔍 **Searching for lyrics...**", ephemeral=True)
         
         # check cache first
-        cache_key = f"{self.artist} - {self.track}"
+        cache_key = track_key(self.artist, self.track)
         cached_data = await cache.get(cache_key) or {}
         lyrics = cached_data.get("lyrics")
 
@@ -47,13 +62,65 @@ class NowPlayingView(discord.ui.View):
         else:
             await interaction.edit_original_response(content="❌ **Lyrics not found.**")
 
+def build_nowplaying_embed(data: dict, album_art: str | None, color: int | None, track_scrobbles: str | None) -> discord.Embed:
+    """builds the now playing embed from whatever pipeline results are available so far"""
+    track = data["track"]
+    artist = data["artist"]
+    album = data["album"]
+
+    status_text = "Now Playing 🎧" if data["now_playing"] else "Last Played 🕒"
+
+    # url encoding for last.fm links
+    artist_url = f"https://www.last.fm/music/{quote(artist)}"
+    album_url = f"{artist_url}/{quote(album)}" if album else ""
+
+    # construct description with font hierarchy
+    # h1 for track (big), bold for artist/album
+    description = f"# {track}\n"
+    description += f"by [**{artist}**]({artist_url})"
+    if album:
+         description += f"\non [**{album}**]({album_url})"
+
+    embed = discord.Embed(
+        description=description, # title moved here for size
+        color=color if color is not None else DEFAULT_COLOR
+    )
+    embed.set_author(name=status_text)
+
+    if album_art:
+        # embed.set_thumbnail(url=album_art) # removed as requested
+        embed.set_image(url=album_art)     # keep large bottom
+
+    # footer with track scrobbles
+    if track_scrobbles is not None:
+        embed.set_footer(text=f"Track Scrobbles: {track_scrobbles}")
+
+    return embed
+
+async def _result_by(task: asyncio.Task, deadline: float):
+    """
+    waits for a pipeline stage until the loop-time deadline.
+    returns None if it failed or is still running (it keeps running either way).
+    """
+    timeout = max(0, deadline - asyncio.get_running_loop().time())
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if not done or task.exception():
+        return None
+    return task.result()
+
+def _settled(task: asyncio.Task):
+    """result of a finished stage, None if pending or failed"""
+    if not task.done() or task.cancelled() or task.exception():
+        return None
+    return task.result()
+
 class NowPlaying(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
     @app_commands.command(
         name="nowplaying",
-        description="Show what I am currently listening to"
+        description="Show what you're currently listening to"
     )
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
@@ -64,7 +131,12 @@ class NowPlaying(commands.Cog):
         # 2. get the shared session from the bot
         session = self.bot.session
 
-        data = await get_now_playing(session)
+        user = await accounts.username_for(interaction.user.id)
+        if not user:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
+
+        data = await get_now_playing(session, user)
 
         if not data:
             await interaction.followup.send("❌ Could not fetch now playing data.", ephemeral=True)
@@ -73,64 +145,91 @@ class NowPlaying(commands.Cog):
         track = data["track"]
         artist = data["artist"]
         album = data["album"]
-        is_playing = data["now_playing"]
 
-        # cache logic
-        cache_key = f"{artist} - {track}"
+        # cache logic: youtube/lyrics live on the track, art and color on the album
+        # (both shared by everyone). the playcount isn't stored, the last.fm response
+        # cache already keeps it for a minute.
+        cache_key = track_key(artist, track)
         cached = await cache.get(cache_key) or {}
-
-        # fetch album art
-        album_art = cached.get("album_art")
-        if not album_art:
-            album_art = await get_album_art(session, artist, album, track)
-            if album_art:
-                cached["album_art"] = album_art
-        
-        # fetch youtube link
-        youtube_link = cached.get("youtube")
-        if not youtube_link:
-            youtube_link = await get_youtube_link(track, artist)
-            if youtube_link:
-                cached["youtube"] = youtube_link
+        art_key = album_key(artist, album) if album else cache_key
+        art_cached = (await cache.get(art_key) or {}) if album else cached
+
+        # 3. fan out. only the color depends on another stage (the album art),
+        # everything else runs concurrently from the start.
+        async def album_art_stage():
+            return (
+                art_cached.get("album_art")
+                or cached.get("album_art") # entries from before art moved to the album
+                or await get_album_art(session, artist, album, track)
+            )
+
+        async def playcount_stage():
+            return await get_track_playcount(session, user, artist, track)
+
+        async def youtube_stage():
+            return cached.get("youtube") or await get_youtube_link(track, artist)
+
+        async def color_stage():
+            if art_cached.get("color") is not None:
+                return art_cached["color"]
+            album_art = await art_task
+            if not album_art:
+                return DEFAULT_COLOR
+            # reuse a collage tile of this art if there is one, else fetch a small variant
+            return await get_dominant_color(
+                session,
+                sized_image_url(album_art, "64s"),
+                tile_url=sized_image_url(album_art, "300x300")
+            )
+
+        art_task = asyncio.create_task(album_art_stage())
+        youtube_task = asyncio.create_task(youtube_stage())
+        color_task = asyncio.create_task(color_stage())
+        playcount_task = asyncio.create_task(playcount_stage())
+        stages = [art_task, youtube_task, color_task, playcount_task]
+
+        # 4. wait for each stage up to its budget, measured from the start of the fan out
+        start = asyncio.get_running_loop().time()
+        album_art = await _result_by(art_task, start + STAGE_TIMEOUTS["album_art"])
+        color = await _result_by(color_task, start + STAGE_TIMEOUTS["album_art"] + STAGE_TIMEOUTS["color"])
+        track_scrobbles = await _result_by(playcount_task, start + STAGE_TIMEOUTS["playcount"])
+        youtube_link = await _result_by(youtube_task, start + STAGE_TIMEOUTS["youtube"])
+
+        embed = build_nowplaying_embed(data, album_art, color, track_scrobbles)
+        view = NowPlayingView(self.bot, youtube_link, track, artist)
+        message = await interaction.followup.send(embed=embed, view=view, wait=True)
+
+        # 5. stages that missed their budget get edited in once they finish. compare against
+        # what was sent, since a stage can also finish while the send is in flight.
+        sent = (album_art, youtube_link, color if color is not None else DEFAULT_COLOR, track_scrobbles)
+        pending = [task for task in stages if not task.done()]
+        if pending:
+            await asyncio.wait(pending, timeout=LATE_TIMEOUT)
+        album_art = _settled(art_task)
+        youtube_link = _settled(youtube_task)
+        color = _settled(color_task)
+        playcount = _settled(playcount_task)
+        if (album_art, youtube_link, color if color is not None else DEFAULT_COLOR, playcount) != sent:
+            embed = build_nowplaying_embed(data, album_art, color, playcount)
+            view = NowPlayingView(self.bot, youtube_link, track, artist)
+            try:
+                await message.edit(embed=embed, view=view)
+            except discord.HTTPException:
+                pass # message deleted or interaction token expired
+        for task in pending:
+            task.cancel()
 
         # update cache
+        if album_art:
+            art_cached["album_art"] = album_art
+        if color is not None and color != DEFAULT_COLOR:
+            art_cached["color"] = color
+        if youtube_link:
+            cached["youtube"] = youtube_link
+        if art_cached and art_key != cache_key:
+            await cache.set(art_key, art_cached)
         if cached:
             await cache.set(cache_key, cached)
 
-        # ui/ux logic
-        color = await get_dominant_color(session, album_art) if album_art else 0x2F3136
-        status_text = "Now Playing 🎧" if is_playing else "Last Played 🕒"
-        
-        # url encoding for last.fm links
-        from urllib.parse import quote
-        artist_url = f"https://www.last.fm/music/{quote(artist)}"
-        album_url = f"{artist_url}/{quote(album)}" if album else ""
-        
-        # construct description with font hierarchy
-        # h1 for track (big), bold for artist/album
-        description = f"# {track}\n"
-        description += f"by [**{artist}**]({artist_url})"
-        if album:
-             description += f"\non [**{album}**]({album_url})"
-        
-        embed = discord.Embed(
-            description=description, # title moved here for size
-            color=color
-        )
-        embed.set_author(name=status_text)
-        
-        if album_art:
-            # embed.set_thumbnail(url=album_art) # removed as requested
-            embed.set_image(url=album_art)     # keep large bottom
-
-        # footer with track scrobbles
-        track_scrobbles = await get_track_playcount(session, artist, track)
-        embed.set_footer(text=f"Track Scrobbles: {track_scrobbles}")
-
-        # controls view with lyrics
-        view = NowPlayingView(self.bot, youtube_link, track, artist)
-
-        await interaction.followup.send(embed=embed, view=view)
-
 async def setup(bot: commands.Bot):
     await bot.add_cog(NowPlaying(bot))
\ No newline at end of file
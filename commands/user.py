@@ -2,6 +2,7 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from services.lastfm import get_user_info, get_recent_tracks
+from utils.accounts import accounts, NOT_LINKED
 from utils.formatting import format_number
 
 class UserCommands(commands.Cog):
@@ -13,8 +14,13 @@ class UserCommands(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def profile(self, interaction: discord.Interaction):
         await interaction.response.defer()
+
+        username = await accounts.username_for(interaction.user.id)
+        if not username:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
         
-        user = await get_user_info(self.bot.session)
+        user = await get_user_info(self.bot.session, username)
         if not user:
             await interaction.followup.send("❌ Could not fetch user data.", ephemeral=True)
             return
@@ -41,8 +47,13 @@ class UserCommands(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def recent(self, interaction: discord.Interaction):
         await interaction.response.defer()
+
+        username = await accounts.username_for(interaction.user.id)
+        if not username:
+            await interaction.followup.send(NOT_LINKED, ephemeral=True)
+            return
         
-        tracks = await get_recent_tracks(self.bot.session, limit=10)
+        tracks = await get_recent_tracks(self.bot.session, username, limit=10)
         if not tracks:
             await interaction.followup.send("❌ Could not fetch recent tracks.", ephemeral=True)
             return
@@ -58,11 +69,35 @@ class UserCommands(commands.Cog):
             description += f"**{i+1}.** [{name}]({track['url']}) - *{artist}*\n"
 
         embed = discord.Embed(title="Recent Tracks", description=description, color=0xba0000)
-        user = await get_user_info(self.bot.session)
+        user = await get_user_info(self.bot.session, username)
         if user:
             embed.set_author(name=f"{user['name']}'s History", icon_url=user['image'][0]['#text'])
             
         await interaction.followup.send(embed=embed)
 
+    @app_commands.command(name="link", description="Link your Last.fm account")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    async def link(self, interaction: discord.Interaction, username: str):
+        await interaction.response.defer(ephemeral=True)
+
+        # make sure the account exists, and store last.fm's spelling of the name
+        user = await get_user_info(self.bot.session, username)
+        if not user:
+            await interaction.followup.send(f"❌ Couldn't find a Last.fm user called **{username}**.", ephemeral=True)
+            return
+
+        await accounts.link(interaction.user.id, user["name"])
+        await interaction.followup.send(f"✅ Linked to **{user['name']}**.", ephemeral=True)
+
+    @app_commands.command(name="unlink", description="Unlink your Last.fm account")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+    async def unlink(self, interaction: discord.Interaction):
+        if await accounts.unlink(interaction.user.id):
+            await interaction.response.send_message("✅ Unlinked your Last.fm account.", ephemeral=True)
+        else:
+            await interaction.response.send_message("❌ You don't have a linked account.", ephemeral=True)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(UserCommands(bot))
@@ -8,11 +8,16 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 
 # last.fm
 LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")
+# optional: account used for discord users who haven't run /link
 LASTFM_USERNAME = os.getenv("LASTFM_USERNAME")
 
 # gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# cache (hot tier held in memory, everything else read lazily from cache.db)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
 # other stuff
 if not DISCORD_TOKEN:
     raise RuntimeError("DISCORD_TOKEN is missing")
@@ -20,7 +25,4 @@ if not DISCORD_TOKEN:
 if not LASTFM_API_KEY:
     raise RuntimeError("LASTFM_API_KEY is missing")
 
-if not LASTFM_USERNAME:
-    raise RuntimeError("LASTFM_USERNAME is missing")
-
 
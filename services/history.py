@@ -0,0 +1,190 @@
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import aiohttp
+
+from services.lastfm import get_scrobbles_page
+from utils.scrobble_index import ScrobbleIndex
+from utils.ttlcache import TTLCache
+
+HISTORY_DB = Path("history.db")
+
+# scrobbles per user.getrecenttracks page (the api maximum)
+PAGE_SIZE = 200
+# backfill pages fetched per sync round, so a huge history fills in gradually
+BACKFILL_PAGES_PER_ROUND = 25
+# users whose columnar index stays in memory; others are rebuilt on demand
+MAX_INDEXES = 32
+
+class HistoryStore:
+    """
+    local copy of a user's scrobbles, plus the sync bookkeeping:
+    backfill walks user.getrecenttracks pages up to a fixed timestamp (so it can
+    resume where it stopped), incremental sync fetches only newer scrobbles.
+    """
+    def __init__(self, path: Path = HISTORY_DB):
+        self.path = path
+        self._conn: sqlite3.Connection = None
+        self._lock = asyncio.Lock()
+        self._indexes = TTLCache(maxsize=MAX_INDEXES)
+        # one thread owns the connection, same as utils.cache
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+
+    def _connect_sync(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scrobbles (
+                user TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT NOT NULL,
+                track TEXT NOT NULL,
+                PRIMARY KEY (user, ts, artist, track)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sync_state (
+                user TEXT PRIMARY KEY,
+                backfill_to INTEGER NOT NULL,
+                backfill_page INTEGER NOT NULL,
+                backfill_done INTEGER NOT NULL,
+                latest_ts INTEGER NOT NULL
+            );
+        """)
+        self._conn = conn
+
+    async def _run(self, fn, *args):
+        if self._conn is None:
+            async with self._lock:
+                if self._conn is None:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, self._connect_sync)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _state_sync(self, user: str):
+        row = self._conn.execute(
+            "SELECT backfill_to, backfill_page, backfill_done, latest_ts FROM sync_state WHERE user = ?", (user,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"backfill_to": row[0], "backfill_page": row[1], "backfill_done": bool(row[2]), "latest_ts": row[3]}
+
+    def _save_sync(self, user: str, scrobbles: list[dict], state: dict):
+        """stores a page of scrobbles and the progress it represents in one transaction"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO scrobbles (user, ts, artist, album, track) VALUES (?, ?, ?, ?, ?)",
+                ((user, s["ts"], s["artist"], s["album"], s["track"]) for s in scrobbles)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user, backfill_to, backfill_page, backfill_done, latest_ts) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user, state["backfill_to"], state["backfill_page"], int(state["backfill_done"]), state["latest_ts"])
+            )
+
+    def _recent_sync(self, user: str, limit: int):
+        rows = self._conn.execute(
+            "SELECT ts, artist, album, track FROM scrobbles WHERE user = ? ORDER BY ts DESC LIMIT ?",
+            (user, limit)
+        ).fetchall()
+        return [dict(zip(("ts", "artist", "album", "track"), row)) for row in rows]
+
+    def _update_index_sync(self, user: str, index: ScrobbleIndex):
+        rows = self._conn.execute(
+            "SELECT ts, artist, album, track FROM scrobbles WHERE user = ? AND ts > ? ORDER BY ts",
+            (user, index.last_ts)
+        ).fetchall()
+        index.extend(rows)
+
+    async def state(self, user: str) -> dict | None:
+        return await self._run(self._state_sync, user)
+
+    async def save(self, user: str, scrobbles: list[dict], state: dict):
+        await self._run(self._save_sync, user, scrobbles, state)
+
+    async def is_complete(self, user: str) -> bool:
+        """True once the backfill has reached the user's first scrobble"""
+        state = await self.state(user)
+        return bool(state and state["backfill_done"])
+
+    async def recent(self, user: str, limit: int = 10) -> list[dict]:
+        return await self._run(self._recent_sync, user, limit)
+
+    async def index(self, user: str) -> ScrobbleIndex | None:
+        """
+        the user's in-memory columnar index, built on first use and topped up with
+        newer scrobbles on every call. None until the backfill is complete, since the
+        index only ever appends and older rows arriving later would be missed.
+        """
+        if not await self.is_complete(user):
+            return None
+        index = self._indexes.get(user)
+        if index is None:
+            index = ScrobbleIndex()
+            self._indexes.set(user, index)
+        # interning runs on the store thread, not the event loop
+        await self._run(self._update_index_sync, user, index)
+        return index
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+async def sync(session: aiohttp.ClientSession, store: "HistoryStore", user: str,
+               backfill_pages: int = BACKFILL_PAGES_PER_ROUND) -> int:
+    """
+    one sync round for a user: pulls every scrobble newer than the last stored one,
+    then continues the backfill for up to backfill_pages pages.
+    progress is saved after every page, so an interrupted round just resumes.
+    returns the number of scrobbles fetched.
+    """
+    state = await store.state(user)
+    if state is None:
+        # backfill everything up to now, incremental sync takes over from here
+        now = int(time.time())
+        state = {"backfill_to": now, "backfill_page": 1, "backfill_done": False, "latest_ts": now}
+        await store.save(user, [], state)
+
+    fetched = 0
+
+    # 1. incremental: newest scrobbles since the last round (pages are newest first).
+    # the window is stored in one transaction: a cached index only appends rows newer than
+    # its last one, so a partly stored window would leave the older pages out of it.
+    since = state["latest_ts"] + 1
+    page, total_pages, newest = 1, 1, state["latest_ts"]
+    window = []
+    while page <= total_pages:
+        result = await get_scrobbles_page(session, user, page=page, limit=PAGE_SIZE, from_ts=since)
+        if result is None:
+            return fetched # retry the whole window next round, latest_ts is unchanged
+        scrobbles, total_pages = result
+        fetched += len(scrobbles)
+        window += scrobbles
+        newest = max([newest] + [s["ts"] for s in scrobbles])
+        page += 1
+    state["latest_ts"] = newest
+    await store.save(user, window, state)
+
+    # 2. backfill: older history below the fixed backfill_to mark
+    for _ in range(backfill_pages):
+        if state["backfill_done"]:
+            break
+        result = await get_scrobbles_page(
+            session, user, page=state["backfill_page"], limit=PAGE_SIZE, to_ts=state["backfill_to"]
+        )
+        if result is None:
+            break
+        scrobbles, total_pages = result
+        fetched += len(scrobbles)
+        state["backfill_page"] += 1
+        state["backfill_done"] = state["backfill_page"] > total_pages
+        await store.save(user, scrobbles, state)
+
+    return fetched
+
+# global instance
+history = HistoryStore()
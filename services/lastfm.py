@@ -1,34 +1,130 @@
 import aiohttp
+import asyncio
 import re
 import config
+from utils import upstream
+from utils.singleflight import SingleFlight
+from utils.ttlcache import TTLCache
 
 BASE_URL = "https://ws.audioscrobbler.com/2.0/"
 
+# response cache policy per api method: (fresh seconds, extra seconds it may be served stale).
+# while stale, callers get the cached response immediately and a refresh runs in the background.
+METHOD_TTLS = {
+    "user.getrecenttracks": (10, 0),
+    "user.getinfo": (600, 3600),
+    "album.getinfo": (24 * 3600, 7 * 24 * 3600),
+    "track.getinfo": (24 * 3600, 7 * 24 * 3600),
+}
+
+# top charts move faster over short periods
+PERIOD_TTLS = {
+    "7day": (300, 1800),
+    "1month": (900, 3600),
+    "3month": (1800, 3600),
+    "6month": (3600, 3 * 3600),
+    "12month": (3600, 6 * 3600),
+    "overall": (3600, 6 * 3600),
+}
+
+# items per page when a top list is fetched in several pages
+TOP_PAGE_SIZE = 50
+
+# identical concurrent calls (same method + params) share one http request
+_inflight = SingleFlight()
+_responses = TTLCache(maxsize=2048)
+_refreshes: set[asyncio.Task] = set()
+
+def sized_image_url(url: str, size: str) -> str:
+    """
+    rewrites a last.fm image url to another size variant of the same asset.
+    size: 34s | 64s | 174s | 300x300 | _ (original resolution)
+    example: .../300x300/abc.jpg -> .../64s/abc.jpg
+    """
+    if not url:
+        return url
+    # replaces the size segment (e.g., /300x300/ or /174s/)
+    return re.sub(r'\/i\/u\/[^\/]+\/', f'/i/u/{size}/', url)
+
 def force_hd_url(url: str) -> str:
     """
     transforms a standard last.fm image url into the original high-res version.
     example: .../300x300/abc.jpg -> .../_/abc.jpg
     """
-    if not url:
-        return url
-    # replaces the size segment (e.g., /300x300/ or /174s/) with /_/ 
-    return re.sub(r'\/i\/u\/[^\/]+\/', '/i/u/_/', url)
+    return sized_image_url(url, "_")
+
+async def _fetch(session: aiohttp.ClientSession, params: dict, remember: bool = True):
+    # paced, retried and circuit broken per utils.upstream
+    return await upstream.get_json(session, BASE_URL, params=params, remember=remember)
+
+def _ttl_for(params: dict) -> tuple[int, int] | None:
+    """returns the (fresh, stale) cache window for a request, or None to skip caching"""
+    method = params["method"].lower()
+    if method == "user.getrecenttracks" and ("from" in params or "to" in params):
+        # history sync pages are read once, caching them only costs memory
+        return None
+    if method.startswith("user.gettop"):
+        return PERIOD_TTLS.get(params.get("period"))
+    if method == "track.getinfo" and "username" in params:
+        # carries the user's playcount, which changes with every scrobble
+        return (60, 300)
+    return METHOD_TTLS.get(method)
+
+async def _fetch_and_store(session: aiohttp.ClientSession, params: dict, key: tuple, ttl: tuple[int, int] | None):
+    # while last.fm is down, cacheable calls fall back to their last good response
+    data = await _fetch(session, params, remember=ttl is not None)
+    if data is not None and ttl:
+        _responses.set(key, data, ttl=sum(ttl))
+    return data
+
+def _refresh_in_background(session: aiohttp.ClientSession, params: dict, key: tuple, ttl: tuple[int, int]):
+    if key in _inflight:
+        return
+
+    async def refresh():
+        try:
+            await _inflight.do(key, lambda: _fetch_and_store(session, params, key, ttl))
+        except Exception:
+            pass # keep serving the stale copy
+
+    task = asyncio.create_task(refresh())
+    _refreshes.add(task)
+    task.add_done_callback(_refreshes.discard)
+
+async def _request(session: aiohttp.ClientSession, params: dict):
+    """
+    performs a last.fm api call, returning the decoded json or None on a non-200.
+    responses are cached per METHOD_TTLS / PERIOD_TTLS with stale-while-revalidate,
+    and concurrent calls with the same params are coalesced into one request.
+    the returned dict is shared between callers, so treat it as read-only.
+    """
+    key = tuple(sorted((k, str(v)) for k, v in params.items()))
+    ttl = _ttl_for(params)
+
+    if ttl:
+        hit = _responses.get_with_age(key)
+        if hit:
+            data, age = hit
+            if age >= ttl[0]:
+                _refresh_in_background(session, params, key, ttl)
+            return data
+
+    return await _inflight.do(key, lambda: _fetch_and_store(session, params, key, ttl))
 
-async def get_now_playing(session: aiohttp.ClientSession):
-    """fetches current track info"""
+async def get_now_playing(session: aiohttp.ClientSession, user: str):
+    """fetches a user's current track info"""
     params = {
         "method": "user.getrecenttracks",
-        "user": config.LASTFM_USERNAME,
+        "user": user,
         "api_key": config.LASTFM_API_KEY,
         "format": "json",
         "limit": 1
     }
     try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status != 200:
-                return None
-            data = await response.json()
-            
+        data = await _request(session, params)
+        if data is None:
+            return None
+
         track = data["recenttracks"]["track"][0]
         total_scrobbles = data["recenttracks"].get("@attr", {}).get("total", "0")
         
@@ -56,14 +152,13 @@ async def get_album_art(session: aiohttp.ClientSession, artist: str, album: str
             "format": "json"
         }
         try:
-            async with session.get(BASE_URL, params=params) as response:
-                if response.status == 200:
-                    res = await response.json()
-                    images = res.get("album", {}).get("image", [])
-                    # grab the first non-empty url (checking largest sizes first)
-                    raw_url = next((img["#text"] for img in reversed(images) if img["#text"]), None)
-                    if raw_url:
-                        return force_hd_url(raw_url)
+            res = await _request(session, params)
+            if res is not None:
+                images = res.get("album", {}).get("image", [])
+                # grab the first non-empty url (checking largest sizes first)
+                raw_url = next((img["#text"] for img in reversed(images) if img["#text"]), None)
+                if raw_url:
+                    return force_hd_url(raw_url)
         except Exception:
             pass
 
@@ -77,125 +172,160 @@ async def get_album_art(session: aiohttp.ClientSession, artist: str, album: str
             "format": "json"
         }
         try:
-            async with session.get(BASE_URL, params=params) as response:
-                if response.status == 200:
-                    res = await response.json()
-                    images = res.get("track", {}).get("album", {}).get("image", [])
-                    raw_url = next((img["#text"] for img in reversed(images) if img["#text"]), None)
-                    if raw_url:
-                        return force_hd_url(raw_url)
+            res = await _request(session, params)
+            if res is not None:
+                images = res.get("track", {}).get("album", {}).get("image", [])
+                raw_url = next((img["#text"] for img in reversed(images) if img["#text"]), None)
+                if raw_url:
+                    return force_hd_url(raw_url)
         except Exception:
             pass
 
     return None
 
-async def get_user_info(session: aiohttp.ClientSession):
+async def get_user_info(session: aiohttp.ClientSession, user: str):
     """fetches user profile information"""
     params = {
         "method": "user.getinfo",
-        "user": config.LASTFM_USERNAME,
+        "user": user,
         "api_key": config.LASTFM_API_KEY,
         "format": "json"
     }
     try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("user")
+        data = await _request(session, params)
+        if data is not None:
+            return data.get("user")
     except Exception:
         pass
     return None
 
-async def get_recent_tracks(session: aiohttp.ClientSession, limit: int = 10):
+async def get_recent_tracks(session: aiohttp.ClientSession, user: str, limit: int = 10):
     """fetches recent tracks"""
     params = {
         "method": "user.getrecenttracks",
-        "user": config.LASTFM_USERNAME,
+        "user": user,
         "api_key": config.LASTFM_API_KEY,
         "format": "json",
         "limit": limit
     }
     try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("recenttracks", {}).get("track", [])
+        data = await _request(session, params)
+        if data is not None:
+            return data.get("recenttracks", {}).get("track", [])
     except Exception:
         pass
     return []
 
-async def get_top_items(session: aiohttp.ClientSession, period: str, method: str, limit: int = 10):
+async def get_scrobbles_page(session: aiohttp.ClientSession, user: str, page: int = 1, limit: int = 200,
+                             from_ts: int = None, to_ts: int = None) -> tuple[list[dict], int] | None:
+    """
+    fetches one page of finished scrobbles (newest first) within [from_ts, to_ts],
+    as {"ts", "artist", "album", "track"} dicts, plus the total page count.
+    returns None on failure so callers can retry the same page later.
+    """
+    params = {
+        "method": "user.getrecenttracks",
+        "user": user,
+        "api_key": config.LASTFM_API_KEY,
+        "format": "json",
+        "limit": limit,
+        "page": page,
+        # an explicit window keeps page boundaries stable while new scrobbles arrive
+        "from": from_ts or 0,
+        "to": to_ts or 0,
+    }
+    if not to_ts:
+        del params["to"]
+    try:
+        data = await _request(session, params)
+        if data is None:
+            return None
+        recent = data["recenttracks"]
+        total_pages = int(recent.get("@attr", {}).get("totalPages", 0))
+        tracks = recent.get("track", [])
+        if isinstance(tracks, dict):
+            tracks = [tracks] # single results come back unwrapped
+        scrobbles = []
+        for track in tracks:
+            if "date" not in track:
+                continue # the track playing right now has no timestamp yet
+            scrobbles.append({
+                "ts": int(track["date"]["uts"]),
+                "artist": track["artist"]["#text"],
+                "album": track.get("album", {}).get("#text", ""),
+                "track": track["name"],
+            })
+        return scrobbles, total_pages
+    except (KeyError, ValueError, TypeError, aiohttp.ClientError):
+        return None
+
+async def get_top_items(session: aiohttp.ClientSession, user: str, period: str, method: str, limit: int = 10, page: int = 1):
     """
     fetches top artists, albums, or tracks
     period: overall | 7day | 1month | 3month | 6month | 12month
     method: user.gettopartists | user.gettopalbums | user.gettoptracks
+    page: 1-based page of `limit` items
     """
     params = {
         "method": method,
-        "user": config.LASTFM_USERNAME,
+        "user": user,
         "api_key": config.LASTFM_API_KEY,
         "format": "json",
         "period": period,
-        "limit": limit
+        "limit": limit,
+        "page": page
     }
     try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                # determine the key based on method name
-                key_map = {
-                    "user.gettopartists": "topartists",
-                    "user.gettopalbums": "topalbums",
-                    "user.gettoptracks": "toptracks"
-                }
-                root_key = key_map.get(method)
-                if root_key:
-                    # the inner list key is usually artist, album, or track
-                    item_key = root_key.replace("top", "").rstrip("s")
-                    return data.get(root_key, {}).get(item_key, [])
+        data = await _request(session, params)
+        if data is not None:
+            # determine the key based on method name
+            key_map = {
+                "user.gettopartists": "topartists",
+                "user.gettopalbums": "topalbums",
+                "user.gettoptracks": "toptracks"
+            }
+            root_key = key_map.get(method)
+            if root_key:
+                # the inner list key is usually artist, album, or track
+                item_key = root_key.replace("top", "").rstrip("s")
+                return data.get(root_key, {}).get(item_key, [])
     except Exception:
         pass
     return []
 
-async def get_weekly_track_chart(session: aiohttp.ClientSession):
-    """fetches the user's weekly track chart list (timeline data)"""
-    # note: user.getweeklytrackchart usually requires a specific from/to range,
-    # but without args it defaults to most recent.
-    # basically, for a timeline, we might want 'user.getweeklychartlist' to show available ranges,
-    # or just use 'user.getrecenttracks' and aggregate manually if we want a detailed history graph.
-    # to keep it simple for now, let's use user.getweeklytrackchart for the last week.
-    params = {
-        "method": "user.getweeklytrackchart",
-        "user": config.LASTFM_USERNAME,
-        "api_key": config.LASTFM_API_KEY,
-        "format": "json"
-    }
-    try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("weeklytrackchart", {}).get("track", [])
-    except Exception:
-        pass
-    except Exception:
-        pass
-    return []
+async def get_top_items_paged(session: aiohttp.ClientSession, user: str, period: str, method: str, total: int, page_size: int = TOP_PAGE_SIZE):
+    """
+    fetches the first `total` top items as concurrent pages of page_size,
+    for lists bigger than one comfortable response
+    """
+    # a small request is a single page of exactly that size, not a full page trimmed down
+    page_size = max(1, min(total, page_size))
+    pages = -(-total // page_size)
+    results = await asyncio.gather(*(
+        get_top_items(session, user, period, method, limit=page_size, page=page)
+        for page in range(1, pages + 1)
+    ))
+    items = []
+    for page_items in results:
+        items.extend(page_items)
+        if len(page_items) < page_size:
+            break # ran out of items, later pages are empty or repeats
+    return items[:total]
 
-async def get_track_playcount(session: aiohttp.ClientSession, artist: str, track: str) -> str:
+async def get_track_playcount(session: aiohttp.ClientSession, user: str, artist: str, track: str) -> str:
     """fetches the user's playcount for a specific track"""
     params = {
         "method": "track.getInfo",
         "api_key": config.LASTFM_API_KEY,
         "artist": artist,
         "track": track,
-        "username": config.LASTFM_USERNAME, # needed to get userplaycount
+        "username": user, # needed to get userplaycount
         "format": "json"
     }
     try:
-        async with session.get(BASE_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get("track", {}).get("userplaycount", "0")
+        data = await _request(session, params)
+        if data is not None:
+            return data.get("track", {}).get("userplaycount", "0")
     except Exception:
         pass
     return "0"
\ No newline at end of file
@@ -1,5 +1,7 @@
 import aiohttp
 
+from utils import upstream
+
 LRCLIB_URL = "https://lrclib.net/api/get"
 
 async def get_lyrics(session: aiohttp.ClientSession, track: str, artist: str) -> str:
@@ -13,11 +15,10 @@ async def get_lyrics(session: aiohttp.ClientSession, track: str, artist: str) ->
     }
     
     try:
-        async with session.get(LRCLIB_URL, params=params) as response:
-            if response.status == 200:
-                data = await response.json()
-                # prioritize plainlyrics (no timestamps)
-                return data.get("plainLyrics")
+        data = await upstream.get_json(session, LRCLIB_URL, params=params)
+        if data:
+            # prioritize plainlyrics (no timestamps)
+            return data.get("plainLyrics")
     except Exception:
         pass
     
@@ -0,0 +1,149 @@
+import time
+import heapq
+import asyncio
+from typing import Awaitable, Callable
+
+import aiohttp
+
+from services.lastfm import get_now_playing
+from utils import upstream
+
+# poll intervals (seconds): fast while something is playing, doubling up to
+# IDLE_MAX while nothing is
+PLAYING_INTERVAL = 15
+IDLE_INTERVAL = 30
+IDLE_MAX = 300
+# global ceiling on last.fm polls, however many users are watched. kept under the
+# background share of last.fm's rate in utils.upstream.
+POLLS_PER_SECOND = 2
+
+Listener = Callable[[str, dict], Awaitable[None]]
+
+class _Watched:
+    __slots__ = ("refs", "interval", "last", "due")
+
+    def __init__(self):
+        self.refs = 0
+        self.interval = PLAYING_INTERVAL
+        self.last = None # (artist, track, now_playing) from the previous poll
+        self.due = 0.0
+
+class NowPlayingPoller:
+    """
+    one background loop that polls user.getrecenttracks for every watched user
+    and tells listeners when a user's track changes. each user is polled once
+    no matter how many panels watch them, on an adaptive interval, and polls
+    are paced to POLLS_PER_SECOND overall.
+    """
+    def __init__(self, session: Callable[[], aiohttp.ClientSession]):
+        self._session = session
+        self._watched: dict[str, _Watched] = {}
+        self._queue: list[tuple[float, str]] = [] # (due, user) min-heap
+        self._listeners: list[Listener] = []
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._polls: set[asyncio.Task] = set()
+
+    def add_listener(self, listener: Listener):
+        """listener(user, now_playing_data) runs on every track change"""
+        self._listeners.append(listener)
+
+    def watch(self, user: str):
+        watched = self._watched.get(user)
+        if watched is None:
+            watched = self._watched[user] = _Watched()
+            self._schedule(user, watched, time.monotonic())
+        watched.refs += 1
+
+    def unwatch(self, user: str):
+        watched = self._watched.get(user)
+        if watched is None:
+            return
+        watched.refs -= 1
+        if watched.refs <= 0:
+            # its heap entry is skipped when it comes up
+            del self._watched[user]
+
+    def last_seen(self, user: str) -> tuple | None:
+        watched = self._watched.get(user)
+        return watched.last if watched else None
+
+    def _schedule(self, user: str, watched: _Watched, due: float):
+        watched.due = due
+        heapq.heappush(self._queue, (due, user))
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        pace = 1 / POLLS_PER_SECOND
+        # polls are background traffic, interactive commands go first
+        with upstream.background():
+            await self._schedule_polls(pace)
+
+    async def _schedule_polls(self, pace: float):
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            due, user = self._queue[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                # sleep until the next poll is due, or a new watch arrives
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            watched = self._watched.get(user)
+            if watched is None or watched.due != due:
+                continue # unwatched, or rescheduled since
+
+            task = asyncio.create_task(self._poll(user, watched))
+            self._polls.add(task)
+            task.add_done_callback(self._polls.discard)
+            await asyncio.sleep(pace)
+
+    async def _poll(self, user: str, watched: _Watched):
+        data = None
+        try:
+            data = await get_now_playing(self._session(), user)
+        except Exception as e:
+            print(f"[ERROR] Now playing poll failed for {user}: {e}")
+
+        if data is None:
+            # upstream trouble, back off like an idle user
+            watched.interval = min(max(watched.interval * 2, IDLE_INTERVAL), IDLE_MAX)
+        else:
+            current = (data["artist"], data["track"], data["now_playing"])
+            changed = current != watched.last
+            watched.last = current
+
+            if data["now_playing"]:
+                watched.interval = PLAYING_INTERVAL
+            elif changed:
+                watched.interval = IDLE_INTERVAL
+            else:
+                watched.interval = min(watched.interval * 2, IDLE_MAX)
+
+            if changed:
+                for listener in self._listeners:
+                    try:
+                        await listener(user, data)
+                    except Exception as e:
+                        print(f"[ERROR] Now playing listener failed for {user}: {e}")
+
+        if self._watched.get(user) is watched:
+            self._schedule(user, watched, time.monotonic() + watched.interval)
@@ -0,0 +1,125 @@
+import asyncio
+from typing import Callable
+
+import aiohttp
+
+from services.lastfm import get_album_art, sized_image_url
+from services.lyrics import get_lyrics
+from services.youtube import get_youtube_link
+from utils import upstream
+from utils.cache import cache, track_key, album_key
+from utils.image import get_dominant_color
+
+# concurrent warm-ups, and tracks allowed to wait for one before new ones are dropped
+PREFETCH_WORKERS = 4
+PREFETCH_QUEUE = 256
+DEFAULT_COLOR = 0x2F3136
+
+class Prefetcher:
+    """
+    warms the shared caches for a track as soon as someone starts playing it:
+    album art and color on the album entry, youtube link and lyrics on the track entry.
+    a track queued by several users is warmed once, and a job whose track every
+    one of its users has already skipped past is dropped before it does more work.
+    """
+    def __init__(self, session: Callable[[], aiohttp.ClientSession], workers: int = PREFETCH_WORKERS):
+        self._session = session
+        self._workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_QUEUE)
+        self._jobs: dict[tuple, set[str]] = {} # (artist, album, track) -> users playing it
+        self._current: dict[str, tuple] = {}   # user -> track they're on now
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def on_track_change(self, user: str, data: dict):
+        """poller listener: queues the user's new track"""
+        if not data["now_playing"]:
+            self._current.pop(user, None)
+            return
+        key = (data["artist"], data["album"], data["track"])
+        self._current[user] = key
+
+        users = self._jobs.get(key)
+        if users is not None:
+            users.add(user) # already queued or running
+            return
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            return # falling behind, /nowplaying still fetches on demand
+        self._jobs[key] = {user}
+
+    def _wanted(self, key: tuple) -> bool:
+        """whether anyone who queued this track is still playing it"""
+        return any(self._current.get(user) == key for user in self._jobs.get(key, ()))
+
+    async def _worker(self):
+        with upstream.background():
+            await self._work()
+
+    async def _work(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                if self._wanted(key):
+                    await self._warm(*key)
+            except Exception as e:
+                print(f"[ERROR] Prefetch failed for {key[0]} - {key[2]}: {e}")
+            finally:
+                self._jobs.pop(key, None)
+                self._queue.task_done()
+
+    async def _warm(self, artist: str, album: str, track: str):
+        session = self._session()
+        key = (artist, album, track)
+        cache_key = track_key(artist, track)
+        art_key = album_key(artist, album) if album else cache_key
+        cached = await cache.get(cache_key) or {}
+        art_cached = (await cache.get(art_key) or {}) if album else cached
+
+        async def art():
+            album_art = art_cached.get("album_art") or cached.get("album_art")
+            if not album_art and self._wanted(key):
+                album_art = await get_album_art(session, artist, album, track)
+            color = art_cached.get("color")
+            if album_art and color is None and self._wanted(key):
+                color = await get_dominant_color(
+                    session,
+                    sized_image_url(album_art, "64s"),
+                    tile_url=sized_image_url(album_art, "300x300")
+                )
+            fields = {"album_art": album_art}
+            if color is not None and color != DEFAULT_COLOR:
+                fields["color"] = color
+            return fields
+
+        async def youtube():
+            if cached.get("youtube") or not self._wanted(key):
+                return {}
+            return {"youtube": await get_youtube_link(track, artist)}
+
+        async def lyrics():
+            if cached.get("lyrics") or not self._wanted(key):
+                return {}
+            return {"lyrics": await get_lyrics(session, track, artist)}
+
+        art_fields, youtube_fields, lyrics_fields = await asyncio.gather(art(), youtube(), lyrics())
+        # re-read before writing so fields stored meanwhile (e.g. by /nowplaying) survive
+        await _merge(art_key, art_fields)
+        await _merge(cache_key, {**youtube_fields, **lyrics_fields})
+
+async def _merge(key: str, fields: dict):
+    fields = {k: v for k, v in fields.items() if v}
+    if not fields:
+        return
+    entry = await cache.get(key) or {}
+    if any(entry.get(k) != v for k, v in fields.items()):
+        await cache.set(key, {**entry, **fields})
@@ -1,34 +1,100 @@
 import yt_dlp
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-async def get_youtube_link(track: str, artist: str) -> str | None:
-    queries = [
-        f"{track} {artist} topic",
-        f"{track} {artist} official audio",
-        f"{track} {artist}",
-    ]
-
-    ydl_opts = {
-        "quiet": True,
-        "skip_download": True,
-        "extract_flat": True,
-    }
-
-    loop = asyncio.get_running_loop()
-
-    def _search(q):
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(f"ytsearch1:{q}", download=False)
-                if info and info.get("entries"):
-                    return info["entries"][0]["id"]
-            except Exception:
-                return None
+from utils.singleflight import SingleFlight
+from utils.ttlcache import TTLCache
+
+YDL_OPTS = {
+    "quiet": True,
+    "skip_download": True,
+    "extract_flat": True,
+    # yt-dlp does its own http, so it gets its own bound on a hung socket
+    "socket_timeout": 10,
+}
+
+class YouTubeResolver:
+    """
+    resolves a track to a youtube link on a dedicated thread pool.
+    each worker thread keeps one YoutubeDL instance alive across searches,
+    the query variants are searched in parallel and misses are remembered,
+    but only when every search finished empty, never because one failed.
+    """
+    def __init__(self, workers: int = 4, miss_ttl: float = 6 * 3600, miss_maxsize: int = 4096):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="youtube")
+        self._local = threading.local()
+        self._misses = TTLCache(maxsize=miss_maxsize, ttl=miss_ttl)
+        self._inflight = SingleFlight()
+
+    def _ydl(self) -> yt_dlp.YoutubeDL:
+        """the calling worker thread's YoutubeDL instance"""
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            ydl = self._local.ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+        return ydl
+
+    def _search(self, query: str) -> str | None:
+        """first result's video id, None if the search came back empty. errors propagate."""
+        info = self._ydl().extract_info(f"ytsearch1:{query}", download=False)
+        if info and info.get("entries"):
+            return info["entries"][0]["id"]
         return None
 
-    for q in queries:
-        video_id = await loop.run_in_executor(None, _search, q)
-        if video_id:
-            return f"https://www.youtube.com/watch?v={video_id}"
+    async def _resolve(self, track: str, artist: str) -> str | None:
+        """
+        the best link found, None only if every search finished empty.
+        raises if nothing was found and at least one search failed.
+        """
+        # best match first: the auto-generated "topic" upload is the plain studio audio
+        queries = [
+            f"{track} {artist} topic",
+            f"{track} {artist} official audio",
+            f"{track} {artist}",
+        ]
+
+        loop = asyncio.get_running_loop()
+        searches = [loop.run_in_executor(self._executor, self._search, q) for q in queries]
+        try:
+            # race them, but only accept a lower priority hit once every
+            # better variant has come back empty (or failed)
+            error = None
+            for search in searches:
+                try:
+                    video_id = await search
+                except Exception as e:
+                    error = e
+                    continue
+                if video_id:
+                    return f"https://www.youtube.com/watch?v={video_id}"
+            if error is not None:
+                raise error
+            return None
+        finally:
+            # searches that haven't started yet are dropped, running ones finish on their own
+            for search in searches:
+                search.cancel()
 
-    return None
+    async def resolve(self, track: str, artist: str) -> str | None:
+        key = (artist.lower(), track.lower())
+        if key in self._misses:
+            return None
+
+        try:
+            link = await self._inflight.do(key, lambda: self._resolve(track, artist))
+        except Exception as e:
+            # a failed search says nothing about the track, so it isn't remembered as a miss
+            print(f"[ERROR] YouTube search failed for {artist} - {track}: {e}")
+            return None
+        if link is None:
+            self._misses.set(key, True)
+        return link
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# global instance
+resolver = YouTubeResolver()
+
+async def get_youtube_link(track: str, artist: str) -> str | None:
+    return await resolver.resolve(track, artist)
@@ -0,0 +1,92 @@
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import config
+from utils.ttlcache import TTLCache
+
+ACCOUNTS_DB = Path("accounts.db")
+
+NOT_LINKED = "❌ Link your Last.fm account first with `/link`."
+
+class Accounts:
+    """
+    discord user id -> last.fm username links.
+    rows are looked up on demand and kept in a bounded lru, nothing is preloaded.
+    """
+    def __init__(self, path: Path = ACCOUNTS_DB, maxsize: int = 10000):
+        self.path = path
+        self._conn: sqlite3.Connection = None
+        self._lock = asyncio.Lock()
+        # misses are cached too (as ""), so unlinked users don't hit the db every command
+        self._lookups = TTLCache(maxsize=maxsize, ttl=3600)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="accounts")
+
+    def _connect_sync(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS links (discord_id INTEGER PRIMARY KEY, username TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS links_username ON links (username)")
+        self._conn = conn
+
+    async def _run(self, fn, *args):
+        if self._conn is None:
+            async with self._lock:
+                if self._conn is None:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, self._connect_sync)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _get_sync(self, discord_id: int):
+        row = self._conn.execute("SELECT username FROM links WHERE discord_id = ?", (discord_id,)).fetchone()
+        return row[0] if row else ""
+
+    def _link_sync(self, discord_id: int, username: str):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO links (discord_id, username) VALUES (?, ?)", (discord_id, username))
+
+    def _unlink_sync(self, discord_id: int):
+        with self._conn:
+            return self._conn.execute("DELETE FROM links WHERE discord_id = ?", (discord_id,)).rowcount > 0
+
+    def _page_sync(self, after: str, limit: int):
+        rows = self._conn.execute(
+            "SELECT DISTINCT username FROM links WHERE username > ? ORDER BY username LIMIT ?", (after, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    async def linked(self, discord_id: int) -> str | None:
+        """the username linked to a discord user, or None"""
+        username = self._lookups.get(discord_id)
+        if username is None:
+            username = await self._run(self._get_sync, discord_id)
+            self._lookups.set(discord_id, username)
+        return username or None
+
+    async def username_for(self, discord_id: int) -> str | None:
+        """
+        the last.fm account a command should use for this discord user:
+        their linked one, else the bot's default account (config.LASTFM_USERNAME), else None
+        """
+        return await self.linked(discord_id) or config.LASTFM_USERNAME or None
+
+    async def link(self, discord_id: int, username: str):
+        await self._run(self._link_sync, discord_id, username)
+        self._lookups.set(discord_id, username)
+
+    async def unlink(self, discord_id: int) -> bool:
+        self._lookups.set(discord_id, "")
+        return await self._run(self._unlink_sync, discord_id)
+
+    async def usernames(self, after: str = "", limit: int = 100) -> list[str]:
+        """one page of distinct linked usernames in name order, for walking every account in batches"""
+        return await self._run(self._page_sync, after, limit)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+# global instance
+accounts = Accounts()
@@ -1,60 +1,215 @@
 import json
+import time
+import sqlite3
 import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-CACHE_FILE = Path("cache.json")
+import config
+
+CACHE_FILE = Path("cache.json")  # legacy whole-file store, migrated on first start
+CACHE_DB = Path("cache.db")
+
+DAY = 24 * 60 * 60
+
+# per-field expiry (seconds) for dict entries. fields not listed never expire.
+FIELD_TTLS = {
+    "youtube": 30 * DAY,
+    "album_art": 30 * DAY,
+    "color": 30 * DAY,
+    "funfacts": 7 * DAY,
+}
+
+def track_key(artist: str, track: str) -> str:
+    """cache key for per-track data (youtube link, lyrics, fun facts)"""
+    return f"{artist} - {track}"
+
+def album_key(artist: str, album: str) -> str:
+    """cache key for per-album data (album art, dominant color)"""
+    return f"album:{artist} - {album}"
+
+def _partition(key: str, user: str | None) -> str:
+    """user-specific data lives under a per-user prefix, shared data doesn't"""
+    return f"user:{user.lower()}:{key}" if user else key
 
 class Cache:
-    def __init__(self):
-        self._data = {}
+    def __init__(self, path: Path = CACHE_DB, max_entries: int = 1000,
+                 max_bytes: int = 8 * 1024 * 1024, field_ttls: dict[str, int] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.field_ttls = field_ttls or {}
+        # hot tier: key -> (value, stamps, size), least recently used first
+        self._hot: OrderedDict[str, tuple] = OrderedDict()
+        self._hot_bytes = 0
         self._loaded = False
         self._lock = asyncio.Lock()
+        self._conn: sqlite3.Connection = None
+        # single writer thread: sqlite connections are not shared across threads
+        # and this keeps disk io off the default executor
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
 
-    def _load_sync(self):
-        """synchronous load for executor"""
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stamps TEXT NOT NULL DEFAULT '{}')"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+        if "stamps" not in columns:
+            # dbs created before field ttls existed
+            conn.execute("ALTER TABLE cache ADD COLUMN stamps TEXT NOT NULL DEFAULT '{}'")
+        return conn
+
+    def _migrate_json(self):
+        """imports a legacy cache.json into the db, then moves it out of the way"""
         if not CACHE_FILE.exists():
-            return {}
+            return
         try:
-            return json.loads(CACHE_FILE.read_text())
+            legacy = json.loads(CACHE_FILE.read_text())
         except (json.JSONDecodeError, UnicodeDecodeError):
-            print(f"⚠️ warning: {CACHE_FILE} is corrupted. resetting cache.")
+            print(f"⚠️ warning: {CACHE_FILE} is corrupted. skipping migration.")
+            legacy = {}
+
+        # legacy entries have no timestamps, so treat them as written now
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO cache (key, value, stamps) VALUES (?, ?, ?)",
+                ((key, json.dumps(value), json.dumps(self._stamp(value, None, None, now)))
+                 for key, value in legacy.items())
+            )
+        CACHE_FILE.rename(CACHE_FILE.with_suffix(".json.migrated"))
+        print(f"[INFO] Migrated {len(legacy)} entries from {CACHE_FILE} to {self.path}")
+
+    def _load_sync(self):
+        """synchronous load for executor"""
+        try:
+            self._conn = self._connect()
+        except sqlite3.DatabaseError:
+            print(f"⚠️ warning: {self.path} is corrupted. resetting cache.")
+            self.path.unlink(missing_ok=True)
+            self._conn = self._connect()
+
+        self._migrate_json()
+
+    def _read_sync(self, key: str):
+        """synchronous single-key read for executor"""
+        row = self._conn.execute("SELECT value, stamps FROM cache WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        try:
+            return json.loads(row[0]), json.loads(row[1]), len(row[0])
+        except json.JSONDecodeError:
+            return None
+
+    def _save_sync(self, key: str, payload: str, stamps: str):
+        """synchronous single-key upsert for executor"""
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stamps) VALUES (?, ?, ?)",
+                (key, payload, stamps)
+            )
+
+    def _stamp(self, value, old_value, old_stamps, now: float) -> dict:
+        """keeps the write time of unchanged fields, stamps changed ones with now"""
+        if not isinstance(value, dict):
             return {}
+        old_value = old_value if isinstance(old_value, dict) else {}
+        old_stamps = old_stamps or {}
+        return {
+            field: old_stamps[field] if field in old_stamps and old_value.get(field) == v else now
+            for field, v in value.items()
+        }
+
+    def _fresh(self, value, stamps: dict):
+        """returns a copy of value without fields past their ttl"""
+        if not isinstance(value, dict):
+            return value
+        now = time.time()
+        return {
+            field: v for field, v in value.items()
+            if field not in self.field_ttls or now - stamps.get(field, now) < self.field_ttls[field]
+        }
+
+    def _remember(self, key: str, value, stamps: dict, size: int):
+        """puts an entry in the hot tier and evicts lru entries over the limits"""
+        if key in self._hot:
+            self._hot_bytes -= self._hot.pop(key)[2]
+        self._hot[key] = (value, stamps, size)
+        self._hot_bytes += size
 
-    def _save_sync(self, data):
-        """synchronous save for executor"""
-        CACHE_FILE.write_text(json.dumps(data, indent=2))
+        while self._hot and (len(self._hot) > self.max_entries or self._hot_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._hot.popitem(last=False)
+            self._hot_bytes -= evicted_size
 
     async def load(self):
-        """loads cache asynchronously if not loaded"""
+        """opens the store asynchronously if not loaded. entries are read lazily."""
         if self._loaded:
             return
-        
+
         loop = asyncio.get_running_loop()
         async with self._lock:
              # double check inside lock
-            if self._loaded: 
+            if self._loaded:
                 return
-            self._data = await loop.run_in_executor(None, self._load_sync)
+            await loop.run_in_executor(self._executor, self._load_sync)
             self._loaded = True
 
-    async def get(self, key: str):
-        """get value by key"""
+    async def get(self, key: str, user: str = None):
+        """get value by key, hot tier first, then disk. pass user for per-user data."""
         if not self._loaded:
             await self.load()
-        return self._data.get(key)
 
-    async def set(self, key: str, value):
-        """set value and save asynchronously"""
+        key = _partition(key, user)
+        entry = self._hot.get(key)
+        if entry is not None:
+            self._hot.move_to_end(key)
+        else:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(self._executor, self._read_sync, key)
+            if key in self._hot:
+                # a set() landed while the row was being read, its value is newer than the disk copy
+                entry = self._hot[key]
+                self._hot.move_to_end(key)
+            elif entry is None:
+                return None
+            else:
+                self._remember(key, *entry)
+
+        value, stamps, _ = entry
+        return self._fresh(value, stamps)
+
+    async def set(self, key: str, value, user: str = None):
+        """set value and persist just that key asynchronously. pass user for per-user data."""
         if not self._loaded:
             await self.load()
-        
-        self._data[key] = value
-        
-        # save to disk
+
+        key = _partition(key, user)
+        old_value, old_stamps, _ = self._hot.get(key, (None, None, 0))
+        stamps = self._stamp(value, old_value, old_stamps, time.time())
+
+        # serialize here so later mutations of value can't race the writer thread
+        payload = json.dumps(value)
+        self._remember(key, json.loads(payload), stamps, len(payload))
+
+        # write only this row, not the whole cache
         loop = asyncio.get_running_loop()
-        # we copy data to avoid thread safety issues during write if it changes
-        data_to_save = self._data.copy()
-        await loop.run_in_executor(None, self._save_sync, data_to_save)
+        await loop.run_in_executor(self._executor, self._save_sync, key, payload, json.dumps(stamps))
+
+    def close(self):
+        """flushes pending writes and closes the db"""
+        self._executor.shutdown(wait=True)
+        if self._conn:
+            self._conn.close()
+            self._conn = None
 
 # global instance
-cache = Cache()
\ No newline at end of file
+cache = Cache(
+    max_entries=config.CACHE_MAX_ENTRIES,
+    max_bytes=config.CACHE_MAX_BYTES,
+    field_ttls=FIELD_TTLS,
+)
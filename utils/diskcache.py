@@ -0,0 +1,106 @@
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+class DiskCache:
+    """
+    directory of files keyed by an arbitrary string, capped by total size.
+    file mtimes double as the lru order, so it survives restarts.
+    """
+    def __init__(self, directory: Path, max_bytes: int, suffix: str = ""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        # file name -> size, least recently used first
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diskcache")
+
+    def _name(self, key: str, suffix: str = None) -> str:
+        return hashlib.sha1(key.encode()).hexdigest() + (self.suffix if suffix is None else suffix)
+
+    def _scan_sync(self):
+        """synchronous index rebuild for executor"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.directory.iterdir():
+            if path.is_file() and not path.name.endswith(".tmp"):
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+
+    async def _load(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._scan_sync)
+            self._loaded = True
+
+    def _touch_sync(self, path: Path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write_sync(self, name: str, data: bytes, evict: list[str]):
+        """synchronous write + eviction for executor"""
+        path = self.directory / name
+        tmp = path.with_name(name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        for old in evict:
+            (self.directory / old).unlink(missing_ok=True)
+
+    async def path(self, key: str, suffix: str = None) -> Path | None:
+        """returns the file for key (marking it recently used), or None on a miss"""
+        await self._load()
+        name = self._name(key, suffix)
+        if name not in self._index:
+            return None
+        self._index.move_to_end(name)
+        path = self.directory / name
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._touch_sync, path)
+        return path
+
+    async def get(self, key: str, suffix: str = None) -> bytes | None:
+        path = await self.path(key, suffix)
+        if path is None:
+            return None
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, path.read_bytes)
+        except OSError:
+            self.discard(path.name)
+            return None
+
+    async def set(self, key: str, data: bytes, suffix: str = None):
+        await self._load()
+        name = self._name(key, suffix)
+        if name in self._index:
+            self._total -= self._index.pop(name)
+        self._index[name] = len(data)
+        self._total += len(data)
+
+        evict = []
+        while self._total > self.max_bytes and len(self._index) > 1:
+            old, size = self._index.popitem(last=False)
+            self._total -= size
+            evict.append(old)
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write_sync, name, data, evict)
+
+    def discard(self, name: str):
+        """forgets an index entry whose file went missing"""
+        if name in self._index:
+            self._total -= self._index.pop(name)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
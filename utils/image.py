@@ -1,75 +1,331 @@
+import os
+import multiprocessing
 import aiohttp
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
-async def create_collage(session: aiohttp.ClientSession, image_urls: list[str], size: int = 3) -> BytesIO:
+from utils import upstream
+from utils.diskcache import DiskCache
+
+IMG_DIM = 300
+PLACEHOLDER_COLOR = (50, 50, 50)
+
+# pre-resized collage tiles keyed by image url + tile size, so repeat collages
+# skip both the download and the full-size decode
+TILE_CACHE_DIR = Path("cache/tiles")
+TILE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+TILE_QUALITY = 90
+
+# downloads larger than this are abandoned mid-stream (original-res art can be several MB)
+MAX_IMAGE_BYTES = 8 * 1024 * 1024
+# simultaneous image downloads per collage
+MAX_CONCURRENT_DOWNLOADS = 8
+# largest collage edge in px; grids past 6x6 get smaller tiles instead of a bigger canvas
+MAX_CANVAS = 1800
+
+tile_cache = DiskCache(TILE_CACHE_DIR, TILE_CACHE_MAX_BYTES, suffix=".jpg")
+
+# finished collages, so an unchanged top list is re-sent without rendering
+COLLAGE_CACHE_DIR = Path("cache/collages")
+COLLAGE_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+collage_cache = DiskCache(COLLAGE_CACHE_DIR, COLLAGE_CACHE_MAX_BYTES)
+
+# collage output formats: name -> (pillow format, file extension)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+
+# collages render in worker processes so pillow never blocks the event loop.
+# the cap keeps a burst of /collage calls from taking every core.
+MAX_CONCURRENT_COLLAGES = max(1, min(2, (os.cpu_count() or 1) // 2))
+
+_pool: ProcessPoolExecutor | None = None
+_collage_slots = asyncio.Semaphore(MAX_CONCURRENT_COLLAGES)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # by now the stores and yt-dlp have threads running, and forking a threaded
+        # process can deadlock the child, so workers come from a clean forkserver
+        _pool = ProcessPoolExecutor(
+            max_workers=MAX_CONCURRENT_COLLAGES, mp_context=multiprocessing.get_context("forkserver")
+        )
+    return _pool
+
+def shutdown():
+    """stops the render workers and flushes the tile cache"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+    tile_cache.close()
+    collage_cache.close()
+
+async def fetch_image_bytes(session: aiohttp.ClientSession, url: str, max_bytes: int = MAX_IMAGE_BYTES) -> bytes | None:
     """
-    creates a square collage from a list of image urls.
-    size: 3 for 3x3, 5 for 5x5
+    streams an image body, giving up once it grows past max_bytes.
+    returns None on any failure.
     """
-    if not image_urls:
+    if not url:
         return None
 
-    # determine individual image size (e.g., 300x300 for 3x3 results in 900x900)
-    IMG_DIM = 300
-    CANVAS_SIZE = size * IMG_DIM
+    async def read(resp: aiohttp.ClientResponse):
+        if resp.content_length and resp.content_length > max_bytes:
+            return None
+        buf = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            buf += chunk
+            if len(buf) > max_bytes:
+                return None
+        return bytes(buf)
 
-    canvas = Image.new("RGB", (CANVAS_SIZE, CANVAS_SIZE), color=(20, 20, 20))
+    try:
+        # image bytes are cached on disk already, so no last good copy is kept in memory
+        return await upstream.get(session, url, read)
+    except Exception:
+        return None
+
+# modes Image.reduce accepts, anything else is converted to RGB first
+REDUCIBLE_MODES = {"L", "LA", "La", "RGB", "RGBA", "RGBa", "RGBX", "CMYK", "I", "F"}
+
+def open_reduced(data: bytes, target: int) -> Image.Image:
+    """
+    decodes an image at roughly the smallest resolution still >= target px per side.
+    jpegs are scaled inside the decoder (draft), other formats are box-reduced
+    right after decoding, so the full-size bitmap never sticks around.
+    """
+    img = Image.open(BytesIO(data))
+    img.draft("RGB", (target, target))
+    factor = min(img.size) // target
+    if factor > 1:
+        if img.mode not in REDUCIBLE_MODES:
+            # palette (gif / png), 1-bit, 16-bit etc. can't be reduced directly
+            img = img.convert("RGB")
+        img = img.reduce(factor)
+    return img.convert("RGB")
+
+def tile_key(url: str, dim: int = IMG_DIM) -> str:
+    return f"{url}|{dim}"
+
+def tile_dim(size: int) -> int:
+    """tile edge for a size x size grid; large grids shrink tiles to cap the canvas"""
+    return min(IMG_DIM, MAX_CANVAS // size)
+
+def color_of(img: Image.Image) -> int:
+    """average color of an image as a hex integer"""
+    # resize to 1x1 to get average color efficiently
+    color = img.convert("RGB").resize((1, 1)).getpixel((0, 0))
+    # convert (r, g, b) to hex integer
+    return (color[0] << 16) + (color[1] << 8) + color[2]
+
+def color_from_bytes(data: bytes) -> int | None:
+    """average color of an encoded image, decoded at reduced size. None if undecodable."""
+    try:
+        return color_of(open_reduced(data, 64))
+    except Exception:
+        return None
+
+def _make_tile(data: bytes, dim: int) -> bytes | None:
+    """runs in a worker process: turns a raw download into a dim x dim jpeg tile"""
+    try:
+        img = open_reduced(data, dim).resize((dim, dim))
+    except Exception:
+        return None
+    tile = BytesIO()
+    img.save(tile, format="JPEG", quality=TILE_QUALITY)
+    return tile.getvalue()
+
+def _compose_collage(tiles: list[bytes | None], size: int, dim: int,
+                     fmt: str = "png", quality: int = 90) -> tuple[bytes, list[int | None]]:
+    """
+    runs in a worker process: pastes pre-made dim x dim tiles in grid order,
+    None for a placeholder. tiles are decoded one at a time, so only the canvas
+    and a single tile are ever held as bitmaps.
+    returns the encoded collage (see OUTPUT_FORMATS) and each slot's dominant
+    color, taken from the tile that was decoded anyway.
+    """
+    # determine the canvas size (e.g., 300x300 tiles in a 3x3 results in 900x900)
+    canvas_size = size * dim
+    canvas = Image.new("RGB", (canvas_size, canvas_size), color=(20, 20, 20))
+    colors = [None] * (size * size)
+    placeholder = Image.new("RGB", (dim, dim), color=PLACEHOLDER_COLOR)
 
-    async def fetch_image(url):
-        if not url:
-            return Image.new("RGB", (IMG_DIM, IMG_DIM), color=(50, 50, 50)) # placeholder
-        try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.read()
-                    img = Image.open(BytesIO(data)).convert("RGB")
-                    return img.resize((IMG_DIM, IMG_DIM))
-        except Exception:
-            pass
-        return Image.new("RGB", (IMG_DIM, IMG_DIM), color=(50, 50, 50))
-
-    # fetch all images concurrently
-    tasks = [fetch_image(url) for url in image_urls[:size*size]]
-    images = await asyncio.gather(*tasks)
-    
     # fill remaining slots with placeholder if we don't have enough images
-    while len(images) < size * size:
-        images.append(Image.new("RGB", (IMG_DIM, IMG_DIM), color=(50, 50, 50)))
+    tiles = list(tiles[:size * size]) + [None] * (size * size - len(tiles))
 
-    # paste images onto canvas
-    for i, img in enumerate(images):
-        x = (i % size) * IMG_DIM
-        y = (i // size) * IMG_DIM
+    for i, data in enumerate(tiles):
+        img = placeholder
+        if data:
+            try:
+                img = Image.open(BytesIO(data)).convert("RGB")
+                colors[i] = color_of(img)
+            except Exception:
+                img = placeholder
+
+        x = (i % size) * dim
+        y = (i // size) * dim
         canvas.paste(img, (x, y))
 
     output = BytesIO()
-    canvas.save(output, format="PNG")
-    output.seek(0)
-    return output
+    pil_format, _ = OUTPUT_FORMATS[fmt]
+    if pil_format == "PNG":
+        canvas.save(output, format="PNG")
+    else:
+        # quality only applies to the lossy formats
+        canvas.save(output, format=pil_format, quality=quality)
+    return output.getvalue(), colors
 
-async def get_dominant_color(session: aiohttp.ClientSession, url: str) -> int:
+async def create_collage(session: aiohttp.ClientSession, image_urls: list[str], size: int = 3,
+                         fmt: str = "png", quality: int = 90) -> tuple[BytesIO, list[int | None]]:
+    """
+    creates a square collage from a list of image urls.
+    size: grid edge, 3 for 3x3 up to 10 for 10x10
+    fmt: png | jpeg | webp, quality: 1-100 for jpeg/webp
+    returns the image and the dominant color of each url (None where it failed),
+    so callers can cache colors without downloading the art again.
     """
-    downloads image and returns the dominant color as a hex integer.
+    if not image_urls:
+        return None, []
+
+    dim = tile_dim(size)
+    loop = asyncio.get_running_loop()
+    downloads = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    async def load_tile(url):
+        if not url:
+            return None
+        key = tile_key(url, dim)
+        tile = await tile_cache.get(key)
+        if tile:
+            return tile
+        async with downloads:
+            data = await fetch_image_bytes(session, url)
+        if not data:
+            return None
+        # shrink as soon as it arrives so raw downloads don't pile up in memory
+        tile = await loop.run_in_executor(_get_pool(), _make_tile, data, dim)
+        if tile:
+            await tile_cache.set(key, tile)
+        return tile
+
+    # load all tiles concurrently (cached tiles need no network)
+    urls = image_urls[:size*size]
+    tiles = await asyncio.gather(*(load_tile(url) for url in urls))
+
+    # paste/encode off the event loop
+    async with _collage_slots:
+        data, colors = await loop.run_in_executor(_get_pool(), _compose_collage, tiles, size, dim, fmt, quality)
+
+    return BytesIO(data), colors[:len(urls)]
+
+CHART_BG = (20, 20, 20)
+CHART_FG = (220, 220, 220)
+CHART_ACCENT = (0xba, 0x00, 0x00) # same red as the chart embeds
+
+def _render_bar_chart(values: list[int], labels: list[str], title: str) -> bytes:
+    """
+    runs in a worker process: draws a bar chart, returns png bytes.
+    labels may be sparser than values; empty strings are skipped.
+    """
+    width, height = 1200, 500
+    left, right, top, bottom = 60, 20, 60, 50
+    img = Image.new("RGB", (width, height), color=CHART_BG)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=16)
+    title_font = ImageFont.load_default(size=24)
+
+    draw.text((left, 18), title, fill=CHART_FG, font=title_font)
+
+    peak = max(values) if values and max(values) else 1
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+    slot = plot_w / max(len(values), 1)
+    gap = min(4, slot * 0.2)
+
+    # y axis: peak value, baseline
+    draw.text((8, top - 8), str(peak), fill=CHART_FG, font=font)
+    draw.text((8, top + plot_h - 8), "0", fill=CHART_FG, font=font)
+    draw.line((left, top + plot_h, width - right, top + plot_h), fill=CHART_FG)
+
+    for i, value in enumerate(values):
+        x0 = left + i * slot + gap / 2
+        x1 = left + (i + 1) * slot - gap / 2
+        bar_h = plot_h * value / peak
+        if bar_h:
+            draw.rectangle((x0, top + plot_h - bar_h, x1, top + plot_h), fill=CHART_ACCENT)
+        if i < len(labels) and labels[i]:
+            draw.text(((x0 + x1) / 2, top + plot_h + 8), labels[i], fill=CHART_FG, font=font, anchor="ma")
+
+    output = BytesIO()
+    img.save(output, format="PNG")
+    return output.getvalue()
+
+def _render_heatmap(grid: list[list[int]], row_labels: list[str], title: str) -> bytes:
+    """
+    runs in a worker process: draws a rows x 24 hour heatmap, returns png bytes.
+    cell brightness is relative to the busiest cell.
+    """
+    cell = 40
+    left, top = 70, 70
+    rows, cols = len(grid), len(grid[0]) if grid else 24
+    width, height = left + cols * cell + 20, top + rows * cell + 40
+    img = Image.new("RGB", (width, height), color=CHART_BG)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=14)
+    title_font = ImageFont.load_default(size=24)
+
+    draw.text((left, 18), title, fill=CHART_FG, font=title_font)
+
+    peak = max((max(row) for row in grid), default=0) or 1
+    for r, row in enumerate(grid):
+        draw.text((10, top + r * cell + cell / 2), row_labels[r], fill=CHART_FG, font=font, anchor="lm")
+        for c, value in enumerate(row):
+            # blend from the background to the accent color
+            t = value / peak
+            color = tuple(int(bg + (fg - bg) * t) for bg, fg in zip(CHART_BG, CHART_ACCENT))
+            x, y = left + c * cell, top + r * cell
+            draw.rectangle((x + 1, y + 1, x + cell - 2, y + cell - 2), fill=color)
+
+    for c in range(0, cols, 3):
+        draw.text((left + c * cell + cell / 2, top + rows * cell + 8), f"{c:02}", fill=CHART_FG, font=font, anchor="ma")
+
+    output = BytesIO()
+    img.save(output, format="PNG")
+    return output.getvalue()
+
+async def render_bar_chart(values: list[int], labels: list[str], title: str) -> BytesIO:
+    """renders a bar chart off the event loop"""
+    loop = asyncio.get_running_loop()
+    async with _collage_slots:
+        data = await loop.run_in_executor(_get_pool(), _render_bar_chart, values, labels, title)
+    return BytesIO(data)
+
+async def render_heatmap(grid: list[list[int]], row_labels: list[str], title: str) -> BytesIO:
+    """renders a heatmap off the event loop"""
+    loop = asyncio.get_running_loop()
+    async with _collage_slots:
+        data = await loop.run_in_executor(_get_pool(), _render_heatmap, grid, row_labels, title)
+    return BytesIO(data)
+
+async def get_dominant_color(session: aiohttp.ClientSession, url: str, tile_url: str = None) -> int:
+    """
+    returns the dominant color of an image as a hex integer.
+    if tile_url names a collage tile that is already cached, that is used and nothing
+    is downloaded; otherwise url is fetched (pass a small variant, only an average is needed).
     returns default discord dark grey (0x2F3136) on failure.
     """
-    if not url:
-        return 0x2F3136
-        
-    try:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                data = await resp.read()
-                img = Image.open(BytesIO(data)).convert("RGB")
-                
-                # resize to 1x1 to get average color efficiently
-                img = img.resize((1, 1))
-                color = img.getpixel((0, 0))
-                
-                # convert (r, g, b) to hex integer
-                return (color[0] << 16) + (color[1] << 8) + color[2]
-    except Exception:
-        pass
-        
-    return 0x2F3136
+    if tile_url:
+        tile = await tile_cache.get(tile_key(tile_url))
+        color = color_from_bytes(tile) if tile else None
+        if color is not None:
+            return color
+
+    data = await fetch_image_bytes(session, url)
+    color = color_from_bytes(data) if data else None
+    return 0x2F3136 if color is None else color
@@ -0,0 +1,112 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Hashable
+
+class SchedulerFull(Exception):
+    """raised instead of queueing once the queue (or the caller's share of it) is full"""
+
+class FairScheduler:
+    """
+    caps how many jobs run at once and queues the rest per user, handing freed slots
+    to users in round robin so one user's burst can't starve everyone else.
+    the cap halves on throttle() (e.g. a 429) and creeps back up by one every
+    recover_after seconds without another throttle.
+    """
+    def __init__(self, max_concurrent: int = 4, max_queued: int = 20, max_per_user: int = 2,
+                 recover_after: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.limit = max_concurrent
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.recover_after = recover_after
+        self._active = 0
+        self._queued = 0
+        # users with waiting jobs, next to be served first
+        self._queues: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+        self._throttled_at = 0.0
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def position(self, user: Hashable, waiter: asyncio.Future) -> int:
+        """1-based place in line: everyone's jobs served before this one in round robin"""
+        queue = self._queues.get(user, ())
+        if waiter not in queue:
+            return 0
+        rounds = list(queue).index(waiter) + 1
+        ahead = 0
+        for other, other_queue in self._queues.items():
+            if other == user:
+                # users after this one in the rotation get one fewer turn before it
+                ahead += rounds
+                rounds -= 1
+            else:
+                ahead += min(len(other_queue), rounds)
+        return ahead
+
+    @asynccontextmanager
+    async def slot(self, user: Hashable, on_queued: Callable[[int], Awaitable] = None):
+        """
+        holds one of the concurrent slots for the body of the with block.
+        waits in user's queue if none is free (awaiting on_queued(position) first),
+        or raises SchedulerFull if the queue is too deep.
+        """
+        if self._active < self.limit and not self._queued:
+            self._active += 1
+        else:
+            queue = self._queues.get(user)
+            if self._queued >= self.max_queued or (queue and len(queue) >= self.max_per_user):
+                raise SchedulerFull(self._queued)
+            waiter = asyncio.get_running_loop().create_future()
+            if queue is None:
+                queue = self._queues[user] = deque()
+            queue.append(waiter)
+            self._queued += 1
+            try:
+                if on_queued:
+                    await on_queued(self.position(user, waiter))
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._release() # the slot was handed over just as we gave up
+                else:
+                    queue.remove(waiter)
+                    self._queued -= 1
+                    if not queue and self._queues.get(user) is queue:
+                        del self._queues[user]
+                raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def throttle(self):
+        """call on a rate limit response: halves the concurrency cap"""
+        limit = max(1, self.limit // 2)
+        if limit < self.limit:
+            print(f"[INFO] Throttling AI requests to {limit} at a time")
+        self.limit = limit
+        self._throttled_at = time.monotonic()
+
+    def _release(self):
+        self._active -= 1
+        if self.limit < self.max_concurrent and time.monotonic() - self._throttled_at >= self.recover_after:
+            self.limit += 1
+            self._throttled_at = time.monotonic()
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.limit and self._queues:
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            self._active += 1
+            waiter.set_result(None)
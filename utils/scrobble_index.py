@@ -0,0 +1,150 @@
+import numpy as np
+
+class Interner:
+    """maps hashable values to dense int ids and back"""
+    def __init__(self):
+        self.ids: dict = {}
+        self.values: list = []
+
+    def id(self, value) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+class ScrobbleIndex:
+    """
+    columnar in-memory copy of one user's history: a sorted timestamp column and
+    interned artist / album / track id columns in numpy arrays.
+    albums and tracks are interned per artist, so two "Greatest Hits" stay apart.
+    rows must be appended in timestamp order.
+    """
+    def __init__(self):
+        self.artists = Interner()  # artist name
+        self.albums = Interner()   # (artist id, album name)
+        self.tracks = Interner()   # (artist id, track name)
+        # album ids for scrobbles without an album, left out of album charts
+        self._blank_albums: list[int] = []
+        self._n = 0
+        self._ts = np.empty(0, dtype=np.int64)
+        self._artist = np.empty(0, dtype=np.int32)
+        self._album = np.empty(0, dtype=np.int32)
+        self._track = np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def ts(self) -> np.ndarray:
+        return self._ts[:self._n]
+
+    @property
+    def last_ts(self) -> int:
+        return int(self._ts[self._n - 1]) if self._n else 0
+
+    def column(self, kind: str) -> np.ndarray:
+        """id column for artists | albums | tracks"""
+        return {"artists": self._artist, "albums": self._album, "tracks": self._track}[kind][:self._n]
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._ts), 1024)
+        for name in ("_ts", "_artist", "_album", "_track"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def extend(self, rows: list[tuple]):
+        """appends (ts, artist, album, track) rows, oldest first"""
+        if not rows:
+            return
+        end = self._n + len(rows)
+        if end > len(self._ts):
+            self._grow(end)
+
+        ts = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        artist_ids = [self.artists.id(row[1]) for row in rows]
+        known_albums = len(self.albums)
+        album_ids = [self.albums.id((a, row[2])) for a, row in zip(artist_ids, rows)]
+        self._blank_albums += [
+            i for i in range(known_albums, len(self.albums)) if not self.albums.values[i][1]
+        ]
+        track_ids = [self.tracks.id((a, row[3])) for a, row in zip(artist_ids, rows)]
+
+        self._ts[self._n:end] = ts
+        self._artist[self._n:end] = artist_ids
+        self._album[self._n:end] = album_ids
+        self._track[self._n:end] = track_ids
+        # publish last, readers only ever look at [:_n]
+        self._n = end
+
+    def window(self, start: int = 0, end: int = None) -> slice:
+        """row slice for timestamps in [start, end), found by binary search"""
+        ts = self.ts
+        lo = int(np.searchsorted(ts, start, side="left"))
+        hi = self._n if end is None else int(np.searchsorted(ts, end, side="left"))
+        return slice(lo, hi)
+
+    def counts(self, kind: str, start: int = 0, end: int = None) -> np.ndarray:
+        """plays per id of kind within [start, end)"""
+        interner = {"artists": self.artists, "albums": self.albums, "tracks": self.tracks}[kind]
+        ids = self.column(kind)[self.window(start, end)]
+        return np.bincount(ids, minlength=len(interner))
+
+    def top(self, kind: str, start: int = 0, end: int = None, limit: int = 10) -> list[dict]:
+        """
+        top artists/albums/tracks in [start, end) as {"artist", "album"/"track", "plays"}
+        dicts, most played first
+        """
+        counts = self.counts(kind, start, end)
+        if kind == "albums":
+            counts[self._blank_albums] = 0 # last.fm's own album chart skips these too
+        if not counts.size:
+            return []
+        limit = min(limit, counts.size)
+        # partial sort: only the top `limit` ids get ordered
+        best = np.argpartition(-counts, limit - 1)[:limit]
+        best = best[np.argsort(-counts[best], kind="stable")]
+
+        results = []
+        for i in best:
+            plays = int(counts[i])
+            if not plays:
+                break
+            if kind == "artists":
+                results.append({"artist": self.artists.values[i], "plays": plays})
+            else:
+                artist_id, name = (self.albums if kind == "albums" else self.tracks).values[i]
+                field = "album" if kind == "albums" else "track"
+                results.append({"artist": self.artists.values[artist_id], field: name, "plays": plays})
+        return results
+
+    def _local(self, start: int, end: int | None, utc_offset: int) -> np.ndarray:
+        """timestamps in [start, end) shifted into local time (utc_offset in seconds)"""
+        return self.ts[self.window(start, end)] + utc_offset
+
+    def by_hour(self, start: int = 0, end: int = None, utc_offset: int = 0) -> np.ndarray:
+        """plays per hour of day, 24 bins"""
+        return np.bincount((self._local(start, end, utc_offset) // 3600) % 24, minlength=24)
+
+    def by_weekday(self, start: int = 0, end: int = None, utc_offset: int = 0) -> np.ndarray:
+        """plays per weekday, 7 bins starting monday"""
+        # the epoch was a thursday, so shift by 3 to make monday bin 0
+        return np.bincount((self._local(start, end, utc_offset) // 86400 + 3) % 7, minlength=7)
+
+    def by_day(self, start: int, end: int, utc_offset: int = 0) -> np.ndarray:
+        """plays per local calendar day from the day containing start up to end"""
+        local = self._local(start, end, utc_offset)
+        first = (start + utc_offset) // 86400
+        days = (end + utc_offset) // 86400 - first + 1
+        return np.bincount(local // 86400 - first, minlength=days)[:days]
+
+    def heatmap(self, start: int = 0, end: int = None, utc_offset: int = 0) -> np.ndarray:
+        """plays per (weekday, hour) as a 7x24 grid, monday first"""
+        local = self._local(start, end, utc_offset)
+        cells = ((local // 86400 + 3) % 7) * 24 + (local // 3600) % 24
+        return np.bincount(cells, minlength=7 * 24).reshape(7, 24)
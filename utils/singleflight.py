@@ -0,0 +1,26 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+class SingleFlight:
+    """
+    coalesces concurrent calls with the same key into one in-flight task.
+    every caller awaiting a key gets the same result (or exception).
+    """
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield so one caller giving up doesn't cancel the request for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+class TTLCache:
+    """
+    small in-memory lru cache where every entry expires after a ttl (seconds).
+    ttl=None means the entry only leaves through lru eviction.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, stored_at, ttl)
+        self._data: OrderedDict[Hashable, tuple] = OrderedDict()
+
+    def _entry(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, stored_at, ttl = entry
+        if ttl is not None and time.monotonic() - stored_at >= ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entry(key)
+        return default if entry is None else entry[0]
+
+    def get_with_age(self, key: Hashable):
+        """returns (value, age in seconds) or None if missing/expired"""
+        entry = self._entry(key)
+        if entry is None:
+            return None
+        return entry[0], time.monotonic() - entry[1]
+
+    def set(self, key: Hashable, value, ttl: float | None = ...):
+        if ttl is ...:
+            ttl = self.ttl
+        self._data[key] = (value, time.monotonic(), ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._entry(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
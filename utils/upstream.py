@@ -0,0 +1,240 @@
+import time
+import random
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.ttlcache import TTLCache
+
+# per-host pacing: (requests per second, burst). hosts not listed get DEFAULT_LIMIT.
+# last.fm asks api clients to stay around 5 requests per second.
+HOST_LIMITS = {
+    "ws.audioscrobbler.com": (5, 10),
+    "lrclib.net": (5, 10),
+    "api.exchangerate-api.com": (1, 2),
+    "lastfm.freetls.fastly.net": (50, 50),
+}
+DEFAULT_LIMIT = (10, 20)
+# share of a host's rate that background work (polling, history sync, prefetch) may use,
+# so interactive commands never queue behind it
+BACKGROUND_SHARE = 0.5
+
+# per-host timeouts (seconds), so a hung upstream can't hold an interaction open.
+# sock_read bounds the gap between body chunks, total the whole request.
+HOST_TIMEOUTS = {
+    "ws.audioscrobbler.com": aiohttp.ClientTimeout(total=10, connect=4, sock_read=8),
+    "lrclib.net": aiohttp.ClientTimeout(total=8, connect=4, sock_read=6),
+    "api.exchangerate-api.com": aiohttp.ClientTimeout(total=10, connect=4, sock_read=8),
+    "lastfm.freetls.fastly.net": aiohttp.ClientTimeout(total=15, connect=4, sock_read=8),
+}
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5, sock_read=10)
+
+# shared connection pool: kept-alive tls connections, capped per host, cached dns lookups
+POOL_LIMIT = 100
+POOL_LIMIT_PER_HOST = 16
+KEEPALIVE_SECONDS = 60
+DNS_CACHE_SECONDS = 300
+
+# retries after the first attempt, for 429 / 5xx / connection errors, with jittered backoff
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.5
+MAX_RETRY_AFTER = 10.0
+# consecutive failed calls that open a host's breaker, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+# last good response per request, served while its host's breaker is open
+LAST_GOOD_SIZE = 1024
+LAST_GOOD_TTL = 24 * 3600
+
+_background = contextvars.ContextVar("upstream_background", default=False)
+
+@contextmanager
+def background():
+    """
+    marks requests made inside the block (and tasks it creates) as background work:
+    they are paced to BACKGROUND_SHARE of the host's rate before joining its bucket.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+class UpstreamError(Exception):
+    """a retryable failure: 429, 5xx, timeout or connection error"""
+
+class TokenBucket:
+    """
+    paces callers to `rate` per second with bursts up to `burst`.
+    tokens can go negative: each caller reserves its slot and sleeps until it comes up,
+    so waiters are served in arrival order.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+class CircuitBreaker:
+    """
+    opens after `threshold` consecutive failures and fails fast for `cooldown` seconds.
+    after that one probe call is let through: success closes it, failure reopens it.
+    """
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        if self._opened_at is not None:
+            print(f"[INFO] {self.name} recovered, closing circuit")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def abandon(self):
+        """the probe ended without a verdict (cancelled, or an unexpected error): let the next call probe"""
+        self._probing = False
+
+    def failure(self):
+        self._failures += 1
+        if self._probing or (self._opened_at is None and self._failures >= self.threshold):
+            if not self._probing:
+                print(f"[ERROR] {self.name} failing, opening circuit for {self.cooldown:.0f}s")
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+class Upstream:
+    """rate limit, retry policy, breaker and last good responses for one host"""
+    def __init__(self, host: str, rate: float, burst: int, timeout: aiohttp.ClientTimeout = DEFAULT_TIMEOUT):
+        self.host = host
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.background_bucket = TokenBucket(rate * BACKGROUND_SHARE, max(1, int(burst * BACKGROUND_SHARE)))
+        self.breaker = CircuitBreaker(host)
+        self.last_good = TTLCache(maxsize=LAST_GOOD_SIZE, ttl=LAST_GOOD_TTL)
+
+    async def _attempt(self, session: aiohttp.ClientSession, url: str, params: dict | None,
+                       read: Callable[[aiohttp.ClientResponse], Awaitable]):
+        if _background.get():
+            # background work waits here, so it never holds more than its share of the host bucket
+            await self.background_bucket.acquire()
+        await self.bucket.acquire()
+        try:
+            async with session.get(url, params=params, timeout=self.timeout) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    retry_after = resp.headers.get("Retry-After", "")
+                    raise UpstreamError(resp.status, float(retry_after) if retry_after.isdigit() else None)
+                if resp.status != 200:
+                    return None # the upstream answered, there's just nothing here
+                return await read(resp)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(type(e).__name__, None) from e
+
+    async def request(self, session: aiohttp.ClientSession, url: str,
+                      read: Callable[[aiohttp.ClientResponse], Awaitable],
+                      params: dict = None, remember: bool = True):
+        """
+        GETs url and returns read(response) for a 200, None for other non-error statuses.
+        429 / 5xx / network errors are retried with backoff; once they exhaust the retries,
+        or while the breaker is open, the last good result for the same request is
+        returned instead (if remember is set and there is one), else None.
+        """
+        key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items()))) if remember else None
+
+        probe = self.breaker.is_open
+        if not self.breaker.allow():
+            return self.last_good.get(key) if remember else None
+
+        try:
+            return await self._request(session, url, read, params, key)
+        except BaseException:
+            # success() / failure() weren't reached, so the breaker would wait on this probe forever
+            if probe:
+                self.breaker.abandon()
+            raise
+
+    async def _request(self, session: aiohttp.ClientSession, url: str,
+                       read: Callable[[aiohttp.ClientResponse], Awaitable], params: dict | None, key):
+        remember = key is not None
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                result = await self._attempt(session, url, params, read)
+            except UpstreamError as e:
+                status, retry_after = e.args
+                if attempt == MAX_RETRIES or self.breaker.is_open:
+                    self.breaker.failure()
+                    print(f"[ERROR] {self.host} request failed ({status}) after {attempt + 1} attempts")
+                    return self.last_good.get(key) if remember else None
+                # full jitter, but never sooner than the server asked
+                delay = random.uniform(0, BACKOFF_BASE * 2 ** attempt)
+                await asyncio.sleep(min(max(delay, retry_after or 0), MAX_RETRY_AFTER))
+                continue
+
+            self.breaker.success()
+            if remember and result is not None:
+                self.last_good.set(key, result)
+            return result
+
+_upstreams: dict[str, Upstream] = {}
+
+def upstream_for(url: str) -> Upstream:
+    """the shared Upstream for url's host, created on first use"""
+    host = urlsplit(url).hostname or ""
+    upstream = _upstreams.get(host)
+    if upstream is None:
+        rate, burst = HOST_LIMITS.get(host, DEFAULT_LIMIT)
+        upstream = _upstreams[host] = Upstream(host, rate, burst, HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUT))
+    return upstream
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    the bot's one http client: a tuned connection pool shared by every service and cog.
+    call from inside the running event loop (e.g. setup_hook).
+    """
+    connector = aiohttp.TCPConnector(
+        limit=POOL_LIMIT,
+        limit_per_host=POOL_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_SECONDS,
+        ttl_dns_cache=DNS_CACHE_SECONDS,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+
+async def _read_json(resp: aiohttp.ClientResponse):
+    return await resp.json()
+
+async def get_json(session: aiohttp.ClientSession, url: str, params: dict = None, remember: bool = True):
+    """decoded json body of a GET through the host's upstream policy, or None"""
+    return await upstream_for(url).request(session, url, _read_json, params=params, remember=remember)
+
+async def get(session: aiohttp.ClientSession, url: str, read: Callable[[aiohttp.ClientResponse], Awaitable],
+              params: dict = None, remember: bool = False):
+    """GET with a custom body reader (e.g. a size capped stream), through the host's upstream policy"""
+    return await upstream_for(url).request(session, url, read, params=params, remember=remember)